@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Combine readings from several meters around the arena over UDP.
+
+Each reader host sends every reading as one 18-byte datagram, in network
+byte order:
+
+    offset  type     field
+         0  char[2]  magic, 'DB'
+         2  uint8    protocol version (1)
+         3  uint8    host id
+         4  uint32   sequence number, wrapping
+         8  int64    Unix timestamp in ms
+        16  uint16   level in tenths of a dB
+
+The reader hosts' clocks needn't agree with the aggregator's. For each
+host it keeps the smallest difference seen between a sample's arrival and
+its timestamp (the clock offset plus the quickest delivery) and shifts
+the host's timestamps onto its own clock by that much. It sorts samples
+into buckets of `bucket_ms` by the shifted timestamp and holds each
+bucket open for `delay_ms` after it ends, so samples which arrive late or
+out of order still count. A closed bucket becomes one arena-wide reading:
+each host's samples in it are energy-averaged (Leq) first, and then the
+hosts' levels are energy-averaged with equal weight, so a host which
+reads more often, or whose samples happen to straddle a bucket edge,
+doesn't count for more of the arena than the others. A sample for a bucket
+which has already closed is counted as late and dropped, and a host which
+goes quiet simply stops contributing. Gaps in a host's sequence numbers
+are counted as lost packets. Numbering which starts over on a sample with
+a later timestamp means the sender was restarted; it is counted as a
+restart, not as reordering.
+
+Reader host (or `python multithreaddbv.py --send-to=HOST:PORT`):
+    python arena.py send --host-id 2 --to 192.168.1.10:5005
+
+Aggregator, printing arena-wide levels:
+    python arena.py aggregate --port 5005
+
+Aggregator feeding the display and publishers:
+    python decibelviz.py --arena=5005
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import collections
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+
+from pipeline import Bus, MeterSource
+from scheduler import DeadlineScheduler, monotonic
+from levels import db_energy, leq
+
+MAGIC = 'DB'
+VERSION = 1
+SAMPLE = struct.Struct('!2sBBIqH')
+SEQ_MODULUS = 2 ** 32
+DEFAULT_PORT = 5005
+
+
+def encode_sample(host_id, seq, t, db):
+    """Return the datagram for one reading.
+
+       Parameters
+       ----------
+         host_id (int) : id of the sending host, 0-255
+         seq (int) : the host's sequence number; wraps at 2**32
+         t (int) : Unix timestamp in milliseconds
+         db (float) : decibel reading
+    """
+    return SAMPLE.pack(MAGIC, VERSION, host_id, seq % SEQ_MODULUS, int(t),
+                       max(0, min(65535, int(round(db * 10)))))
+
+
+def decode_sample(data):
+    """Return (host id, sequence number, timestamp, dB) from a datagram.
+
+       Raises
+       ------
+         ValueError : the datagram isn't a sample of this version
+    """
+    if len(data) != SAMPLE.size:
+        raise ValueError('sample must be {} bytes'.format(SAMPLE.size))
+    magic, version, host_id, seq, t, tenths = SAMPLE.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a version {} sample'.format(VERSION))
+    return host_id, seq, t, tenths / 10
+
+
+def parse_address(text, default_host='127.0.0.1'):
+    """Return (host, port) from 'HOST:PORT', ':PORT' or 'PORT'."""
+    host, _, port = text.rpartition(':')
+    return host or default_host, int(port)
+
+
+class SampleSender(object):
+    """Send each reading to the aggregator, so a sender can join a Bus."""
+
+    def __init__(self, host_id, address):
+        """Initialize the SampleSender object.
+
+           Parameters
+           ----------
+             host_id (int) : this host's id, 0-255, unique in the arena
+             address (tuple) : (host, port) of the aggregator
+        """
+        self.host_id = host_id
+        self.address = address
+        self.seq = 0
+        self.errors = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, reading):
+        self.seq = (self.seq + 1) % SEQ_MODULUS
+        try:
+            self.sock.sendto(encode_sample(self.host_id, self.seq,
+                                           reading[0], reading[1]),
+                             self.address)
+        except socket.error:
+            # the aggregator counts the gap; the reader carries on
+            self.errors += 1
+
+    def close(self):
+        self.sock.close()
+
+
+class HostStats(object):
+    """Sequence tracking and counters for one sending host."""
+
+    def __init__(self, recent=64):
+        self.highest = None
+        # timestamp of the sample with the highest sequence number
+        self.highest_t = None
+        # (sequence number, timestamp) of the latest samples
+        self.recent = collections.deque(maxlen=recent)
+        self.received = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.late = 0
+        self.restarts = 0
+        self.last_seen = None
+        # smallest arrival time minus timestamp seen, in ms
+        self.offset = None
+
+    def accept(self, seq, t, now):
+        """Note a sample's sequence number and timestamp; return False
+           for a duplicate.
+        """
+        if (seq, t) in self.recent:
+            self.duplicates += 1
+            return False
+        self.recent.append((seq, t))
+        self.received += 1
+        self.last_seen = now
+        if self.highest is None:
+            self.highest, self.highest_t = seq, t
+            return True
+        ahead = (seq - self.highest) % SEQ_MODULUS
+        if 0 < ahead < SEQ_MODULUS // 2:
+            self.lost += ahead - 1
+            self.highest, self.highest_t = seq, t
+        elif t > self.highest_t:
+            # numbering started over, so the sender was restarted; its
+            # clock may have been reset as well
+            self.restarts += 1
+            self.highest, self.highest_t = seq, t
+            self.offset = None
+        else:
+            # arrived after a later one; it was counted as lost then
+            self.reordered += 1
+            self.lost = max(0, self.lost - 1)
+        return True
+
+    def local_time(self, t, now_ms):
+        """Return the host's timestamp `t` moved onto the local clock.
+
+           Parameters
+           ----------
+             t (int) : timestamp the host put on a sample, in ms
+             now_ms (int) : local time the sample arrived, in ms
+        """
+        if self.offset is None or now_ms - t < self.offset:
+            self.offset = now_ms - t
+        return t + self.offset
+
+    def stats(self):
+        return {'received': self.received, 'lost': self.lost,
+                'duplicates': self.duplicates,
+                'reordered': self.reordered, 'late': self.late,
+                'restarts': self.restarts, 'last_seen': self.last_seen,
+                'offset_ms': self.offset}
+
+
+class Aggregator(object):
+    """Merge samples from many hosts into arena-wide readings."""
+
+    def __init__(self, bucket_ms=1000, delay_ms=1500):
+        """Initialize the Aggregator object.
+
+           Parameters
+           ----------
+             bucket_ms (int) : length of the time slice each arena-wide
+               reading covers
+             delay_ms (int) : how long a slice stays open after it ends,
+               waiting for late and reordered samples
+        """
+        self.bucket_ms = bucket_ms
+        self.delay_ms = delay_ms
+        # bucket start --> {host id: [energy sum, sample count]}
+        self.buckets = {}
+        # start of the oldest bucket still open
+        self.closed_before = None
+        self.hosts = {}
+
+    def add(self, host_id, seq, t, db, now=None):
+        """Add a sample; return False if it was a duplicate or too late."""
+        if now is None:
+            now = time.time()
+        host = self.hosts.get(host_id)
+        if host is None:
+            host = self.hosts[host_id] = HostStats()
+        if not host.accept(seq, t, now):
+            return False
+        t = host.local_time(t, int(now * 1000))
+        start = t - t % self.bucket_ms
+        if self.closed_before is not None and start < self.closed_before:
+            host.late += 1
+            return False
+        bucket = self.buckets.setdefault(start, {})
+        totals = bucket.get(host_id)
+        if totals is None:
+            totals = bucket[host_id] = [0.0, 0]
+        totals[0] += db_energy(db)
+        totals[1] += 1
+        return True
+
+    def flush(self, now_ms):
+        """Close the buckets whose wait is over.
+
+           Parameters
+           ----------
+             now_ms (int) : current Unix time in milliseconds
+
+           Returns
+           -------
+             (list) : (bucket start in ms, arena-wide dB, hosts heard)
+               for each closed bucket, oldest first; every host heard
+               counts equally, however many samples it sent
+        """
+        cutoff = now_ms - self.delay_ms - self.bucket_ms
+        closed = []
+        for start in sorted(s for s in self.buckets if s <= cutoff):
+            hosts = self.buckets.pop(start)
+            # the mean energy of each host, averaged over the hosts
+            energy = sum(e / n for e, n in hosts.itervalues())
+            closed.append((start, leq(energy, len(hosts)), len(hosts)))
+        boundary = cutoff - cutoff % self.bucket_ms + self.bucket_ms
+        if self.closed_before is None or boundary > self.closed_before:
+            self.closed_before = boundary
+        return closed
+
+    def stats(self):
+        """Return per-host counters, keyed by host id."""
+        return dict((host_id, host.stats())
+                    for host_id, host in self.hosts.iteritems())
+
+
+class ArenaReceiver(object):
+    """Receive samples on a UDP port and hand out arena-wide readings.
+
+       It offers the same `start`, `request`, `poll`, `stuck`, `stale`
+       and `stop` methods as `meterworker.MeterWorker`, so the display can
+       use it in place of a local meter.
+    """
+
+    def __init__(self, port=DEFAULT_PORT, host='0.0.0.0', bucket_ms=1000,
+                 delay_ms=1500, stale_after=5.0, clock=time.time):
+        """Initialize the ArenaReceiver object; `start` binds the socket.
+
+           Parameters
+           ----------
+             port (int) : UDP port to listen on; 0 picks a free one
+             host (str) : interface to listen on
+             bucket_ms (int) : see `Aggregator`
+             delay_ms (int) : see `Aggregator`
+             stale_after (float) : seconds without any sample after which
+               the arena is reported as stale
+             clock (function) : returns the current Unix time in seconds
+        """
+        self.aggregator = Aggregator(bucket_ms, delay_ms)
+        self.stale_after = stale_after
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.invalid = 0
+        self.last_sample = None
+        self.running = False
+        self.thread = None
+        self.host = host
+        self.port = port
+        self.sock = None
+
+    @property
+    def address(self):
+        """(host, port) the receiver is bound to, once started."""
+        if self.sock is None:
+            return self.host, self.port
+        return self.sock.getsockname()
+
+    def start(self):
+        """Bind the socket, start the receiving thread and return self.
+
+           A receiver can be started again after `stop`.
+        """
+        if self.running:
+            return self
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((self.host, self.port))
+        self.sock.settimeout(0.2)
+        self.running = True
+        self.last_sample = monotonic()
+        self.thread = threading.Thread(target=self._run, args=(self.sock,),
+                                       name='arena')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop receiving and close the socket."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1)
+            self.thread = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _run(self, sock):
+        while self.running:
+            try:
+                data, _ = sock.recvfrom(64)
+            except socket.timeout:
+                continue
+            except socket.error:
+                # closed under us, or broken; either way it's finished
+                return
+            try:
+                sample = decode_sample(data)
+            except ValueError:
+                self.invalid += 1
+                continue
+            with self.lock:
+                self.aggregator.add(*sample, now=self.clock())
+            self.last_sample = monotonic()
+
+    def request(self):
+        """Readings arrive by themselves; there's nothing to ask for."""
+        return True
+
+    def poll(self):
+        """Return the arena-wide readings completed since the last poll,
+           as ('ok', timestamp in ms, dB) tuples like MeterWorker's.
+        """
+        with self.lock:
+            closed = self.aggregator.flush(int(self.clock() * 1000))
+        return [('ok', start, level) for start, level, _ in closed]
+
+    def stuck(self):
+        return False
+
+    def stale(self):
+        """Return True if no host has been heard from for too long."""
+        return (self.last_sample is not None and
+                monotonic() - self.last_sample > self.stale_after)
+
+    def stats(self):
+        """Return per-host counters and the count of invalid datagrams."""
+        with self.lock:
+            hosts = self.aggregator.stats()
+        return {'hosts': hosts, 'invalid': self.invalid}
+
+
+def send(args):
+    """Read the local meter once a second and send every reading."""
+    # imported here so that the aggregator needs no USB support
+    from multithreaddbv import DBMeterReader
+    bus = Bus()
+    sender = bus.subscribe(SampleSender(args.host_id,
+                                        parse_address(args.to)))
+    if args.verbose:
+        bus.subscribe(print)
+    source = MeterSource(bus, DBMeterReader(queue=None)._db_value)
+    scheduler = DeadlineScheduler()
+    scheduler.every(args.interval, source.poll, name='acquire')
+    try:
+        scheduler.run(lambda: True)
+    except KeyboardInterrupt:
+        pass
+    sender.close()
+
+
+def aggregate(args):
+    """Print each arena-wide reading as it is completed."""
+    receiver = ArenaReceiver(args.port, bucket_ms=args.bucket,
+                             delay_ms=args.delay).start()
+    try:
+        while True:
+            time.sleep(args.bucket / 1000)
+            for _, t, level in receiver.poll():
+                print(json.dumps([t, level]))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+        print(json.dumps(receiver.stats(), sort_keys=True), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers()
+    sender = commands.add_parser('send', help='send local meter readings')
+    sender.add_argument('--host-id', type=int, required=True,
+                        help='id of this host, 0-255')
+    sender.add_argument('--to', required=True,
+                        help='aggregator address, HOST:PORT')
+    sender.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between readings')
+    sender.add_argument('--verbose', action='store_true',
+                        help='print every reading sent')
+    sender.set_defaults(func=send)
+    aggregator = commands.add_parser('aggregate',
+                                     help='print arena-wide readings')
+    aggregator.add_argument('--port', type=int, default=DEFAULT_PORT)
+    aggregator.add_argument('--bucket', type=int, default=1000,
+                            help='ms covered by each arena-wide reading')
+    aggregator.add_argument('--delay', type=int, default=1500,
+                            help='ms to wait for late samples')
+    aggregator.set_defaults(func=aggregate)
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Load optional backends only when they are first used.
+
+The USB meter driver (pyusb), the GUI toolkit and the FTP client are
+registered here by name instead of being imported at the top of each
+script, as are the app's own optional features: the session catalog
+(sqlite3), the live feed (mmap) and the arena link (socket). A
+module-level stand-in such as
+
+    Tkinter = backends.lazy('gui')
+
+imports the real module the first time one of its attributes is looked
+up, so demo mode runs without pyusb installed and nobody pays for a
+backend they don't use. Each import is timed; `timing_report` lists
+those times along with any `mark`s recorded during startup.
+"""
+
+from __future__ import print_function, division
+
+import importlib
+import time
+
+# when this module was first imported, i.e. early in startup
+STARTED = time.time()
+
+REGISTRY = {
+    'usb': 'usb.core',
+    'gui': 'Tkinter',
+    'ftp': 'ftplib',
+    'catalog': 'sessionstore',
+    'livefeed': 'livefeed',
+    'arena': 'arena',
+}
+
+_loaded = {}
+_failed = {}
+_marks = []
+
+
+def register(name, module_name):
+    """Make a module available as a backend.
+
+       Parameters
+       ----------
+         name (str) : backend name, e.g. 'gui'
+         module_name (str) : dotted name of the module to import
+    """
+    REGISTRY[name] = module_name
+    _loaded.pop(name, None)
+    _failed.pop(name, None)
+
+
+def install(name, module):
+    """Use an already imported module, e.g. a stand-in, as a backend."""
+    _loaded[name] = module
+    _failed.pop(name, None)
+
+
+def load(name):
+    """Import a backend on first use and return the module.
+
+       Raises
+       ------
+         ImportError : the backend's module isn't installed
+    """
+    try:
+        return _loaded[name]
+    except KeyError:
+        pass
+    if name in _failed:
+        raise ImportError(_failed[name])
+    began = time.time()
+    try:
+        module = importlib.import_module(REGISTRY[name])
+    except ImportError as e:
+        # don't search sys.path again on every call, e.g. every reading
+        _failed[name] = str(e)
+        mark('{} backend unavailable: {}'.format(name, e))
+        raise
+    _loaded[name] = module
+    mark('loaded {} backend ({})'.format(name, REGISTRY[name]),
+         duration=time.time() - began)
+    return module
+
+
+def available(name):
+    """Return True if a backend can be loaded."""
+    try:
+        load(name)
+    except ImportError:
+        return False
+    return True
+
+
+class LazyModule(object):
+    """Stand-in for a backend module which imports it on first use."""
+
+    def __init__(self, name):
+        """Initialize the LazyModule object.
+
+           Parameters
+           ----------
+             name (str) : registered backend name
+        """
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(load(self._name), attr)
+
+    def __repr__(self):
+        return '<lazy backend {!r}>'.format(self._name)
+
+
+def lazy(name):
+    """Return a LazyModule for a registered backend."""
+    return LazyModule(name)
+
+
+def mark(label, duration=None):
+    """Record that a startup milestone has been reached.
+
+       Parameters
+       ----------
+         label (str) : description of the milestone
+         duration (float) : how long the step itself took, in seconds
+    """
+    _marks.append((time.time() - STARTED, label, duration))
+
+
+def timing_report():
+    """Return the recorded startup milestones, one per line."""
+    lines = []
+    for elapsed, label, duration in _marks:
+        line = '{:8.1f} ms  {}'.format(elapsed * 1000, label)
+        if duration is not None:
+            line += ' in {:.1f} ms'.format(duration * 1000)
+        lines.append(line)
+    return '\n'.join(lines)
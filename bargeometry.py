@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Precomputed geometry of the bar chart.
+
+A bar is a stack of 10-pixel bins, each in its own color, with a shorter
+bin on top. Rather than work the bins out for every bar of every frame,
+BarGeometry builds them once for every height the chart can show, in
+steps of 0.1 (the meter's resolution), and drawing a bar becomes a table
+lookup. The bars' left edges and the frame's coordinates are computed
+once too. Tables are cached by size and colors, so DecibelVisualizer and
+GuiDisplay share one. Both bind their canvas's `<Configure>` event and
+call `bar_geometry` again when its width changes; the bins don't depend
+on the width, so only the cheap edges and frame are worked out anew.
+"""
+
+from __future__ import print_function, division
+
+# (baseline, width, colors, ...) --> BarGeometry
+_cache = {}
+# (baseline, fills, bin_height, resolution) --> bins for every height
+_bins = {}
+
+
+class BarGeometry(object):
+    """Bin rectangles and colors for every bar height, in 0.1 steps."""
+
+    def __init__(self, baseline, width, colors, bin_height=10, bars=10,
+                 left=20, spacing=30, resolution=10):
+        """Initialize the BarGeometry object, building the tables.
+
+           Parameters
+           ----------
+             baseline (int) : y position of the bottom of the bars
+             width (int) : width of the chart, for the frame
+             colors (dict) : bin index --> fill color, from 0 at the
+               bottom up; the number of colors limits the bar height
+             bin_height (int) : height of a full bin in pixels
+             bars (int) : number of bars across the chart
+             left (int) : left edge of the first bar
+             spacing (int) : distance between the bars' left edges
+             resolution (int) : table entries per pixel of height
+        """
+        self.baseline = baseline
+        self.resolution = resolution
+        self.frame = (10, 10, 10, baseline, width, baseline)
+        self.edges = tuple(left + i * spacing for i in xrange(bars))
+        self.right_to_left = self.edges[::-1]
+        fills = tuple(colors[i] for i in sorted(colors))
+        self.max_key = len(fills) * bin_height * resolution - 1
+        key = (baseline, fills, bin_height, resolution)
+        self.bins = _bins.get(key)
+        if self.bins is None:
+            self.bins = _bins[key] = tuple(
+                self._stack(k / resolution, fills, bin_height)
+                for k in xrange(self.max_key + 1))
+
+    def _stack(self, bar_height, fills, bin_height):
+        """Return the (y1, y2, color) bins of a bar, bottom first."""
+        stack = []
+        built = 0
+        for i in xrange(int(bar_height) // bin_height + 1):
+            # the topmost bin will often be shorter than the usual bin
+            size = min(bar_height - i * bin_height, bin_height)
+            built += size
+            if built > bar_height:
+                break
+            stack.append((self.baseline - (i * bin_height + size),
+                          self.baseline - i * bin_height, fills[i]))
+        return tuple(stack)
+
+    def bar(self, height):
+        """Return the (y1, y2, color) bins of a bar `height` pixels tall."""
+        key = int(height * self.resolution + 0.5)
+        if key < 0:
+            return ()
+        return self.bins[min(key, self.max_key)]
+
+
+def canvas_width(event):
+    """Return the drawable width of a canvas from its `<Configure>` event.
+
+       The event's width includes the canvas's border and focus highlight,
+       which the width it was created with doesn't.
+    """
+    canvas = event.widget
+    border = (int(canvas.cget('highlightthickness')) +
+              int(canvas.cget('borderwidth')))
+    return event.width - 2 * border
+
+
+def bar_geometry(baseline, width, colors, **kwargs):
+    """Return the shared BarGeometry for these dimensions and colors.
+
+       Parameters are as for BarGeometry.
+    """
+    key = (baseline, width, tuple(sorted(colors.iteritems())),
+           tuple(sorted(kwargs.iteritems())))
+    geometry = _cache.get(key)
+    if geometry is None:
+        geometry = _cache[key] = BarGeometry(baseline, width, colors,
+                                             **kwargs)
+    return geometry
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Periodic checkpoints of a running session's aggregate state.
+
+Restarting the app mid-game would otherwise reset the average and maximum
+to the meter's minimum and lose the history strip. A checkpoint holds
+only bounded aggregates (running sums and maximum, the level histogram,
+the decimated history, the last few minutes of readings and the upload
+counter), so writing one is cheap and restoring it takes the same time
+however long the game has been running. Readings taken while the app was
+down are simply missing.
+
+Checkpoints are written to a temporary file and renamed into place, so a
+crash while writing leaves the previous one intact. A checkpoint older
+than `max_age` is assumed to belong to an earlier game and is ignored.
+"""
+
+from __future__ import print_function, division
+
+import json
+import os
+import time
+
+VERSION = 1
+
+
+class Checkpoint(object):
+    """A JSON file holding the latest saved session state."""
+
+    def __init__(self, path, max_age=6 * 3600):
+        """Initialize the Checkpoint object.
+
+           Parameters
+           ----------
+             path (str) : location of the checkpoint file
+             max_age (float) : seconds after which a checkpoint is too old
+               to resume from
+        """
+        self.path = path
+        self.max_age = max_age
+        self.saves = 0
+
+    def save(self, state):
+        """Replace the checkpoint with `state`, a JSON-serializable dict."""
+        record = {'version': VERSION, 'saved_at': time.time(),
+                  'state': state}
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as stream:
+            json.dump(record, stream, separators=(',', ':'))
+        # Windows won't rename over an existing file
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp, self.path)
+        self.saves += 1
+
+    def load(self):
+        """Return the saved state, or None if there's none to resume."""
+        try:
+            with open(self.path, 'r') as stream:
+                record = json.load(stream)
+        except (IOError, ValueError):
+            return None
+        if record.get('version') != VERSION:
+            return None
+        if time.time() - record.get('saved_at', 0) > self.max_age:
+            return None
+        return record['state']
+
+    def clear(self):
+        """Remove the checkpoint, e.g. once the game has been archived."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Deadband and run-length encoding of (timestamp, dB) readings.
+
+A quiet arena produces long runs of identical readings. Run-length
+encoding folds each run into one entry without losing anything:
+
+    [t, db, gap1, gap2, ...]
+
+is the reading `[t, db]` followed by one more reading of `db` for every
+gap, each `gap` milliseconds after the one before. A run of one is just
+the plain `[t, db]` pair, so plain and encoded lists share one format and
+`expand` accepts either.
+
+Deadband compression is lossy: a reading is kept only when the level has
+moved more than `db` decibels from the last kept reading, or when `ms`
+milliseconds have passed since it. The last reading is always kept, so a
+session keeps its full length. Deadband output can be run-length encoded
+as well; the readings kept by the time limit alone then fold into runs.
+"""
+
+from __future__ import print_function, division
+
+
+def deadband(readings, db=0.5, ms=None):
+    """Yield only the readings which differ enough from the last one kept.
+
+       Parameters
+       ----------
+         readings (iterable) : chronological (timestamp, dB) pairs
+         db (float) : change in dB which is always kept; a change of
+           exactly `db` is dropped
+         ms (int) : milliseconds after which a reading is kept even if
+           the level hasn't moved, or None for no time limit
+    """
+    kept = held = None
+    for reading in readings:
+        t, level = reading[0], reading[1]
+        if (kept is None or abs(level - kept[1]) > db or
+                (ms is not None and t - kept[0] >= ms)):
+            kept = reading
+            held = None
+            yield reading
+        else:
+            held = reading
+    if held is not None:
+        yield held
+
+
+def run_length_encode(readings):
+    """Yield run-length encoded entries for chronological readings.
+
+       Parameters
+       ----------
+         readings (iterable) : chronological (timestamp, dB) pairs
+    """
+    run = None
+    for t, db in readings:
+        if run is not None and db == run[1]:
+            run.append(t - last)
+        else:
+            if run is not None:
+                yield run
+            run = [t, db]
+        last = t
+    if run is not None:
+        yield run
+
+
+def expand(entries):
+    """Yield (timestamp, dB) tuples from plain or run-length entries.
+
+       Parameters
+       ----------
+         entries (iterable) : [t, db] pairs and [t, db, gap, ...] runs,
+           e.g. a session archive loaded with `json.load`
+    """
+    for entry in entries:
+        t, db = entry[0], entry[1]
+        yield (t, db)
+        for gap in entry[2:]:
+            t += gap
+            yield (t, db)
+
+
+class Compactor(object):
+    """Encoding applied to the session archive and the published stream."""
+
+    def __init__(self, run_length=True, deadband_db=None, deadband_ms=None):
+        """Initialize the Compactor object.
+
+           Parameters
+           ----------
+             run_length (boolean) : fold runs of identical readings?
+             deadband_db (float) : drop readings within this many dB of
+               the last one kept, or None to keep every reading
+             deadband_ms (int) : keep a reading at least this often even
+               within the deadband, or None for no time limit
+        """
+        self.run_length = run_length
+        self.deadband_db = deadband_db
+        self.deadband_ms = deadband_ms
+
+    def __call__(self, readings):
+        """Return the encoded readings as a list."""
+        return list(self.encode(readings))
+
+    def encode(self, readings):
+        """Yield the encoded entries for chronological readings."""
+        if self.deadband_db is not None:
+            readings = deadband(readings, self.deadband_db,
+                                self.deadband_ms)
+        if self.run_length:
+            return run_length_encode(readings)
+        return iter(readings)
@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Postgame and season statistics over saved session archives.
+
+Archives are summarized by a pool of worker processes. An archive with a
+sidecar index (see `sessionfile`) is split at index points into one part
+per worker, so even a season of a few very long games keeps every core
+busy. Workers return small partial aggregates. The parts of an archive
+are joined in order, and each game is printed as soon as all of its parts
+have arrived and merged into the season totals. Archives are streamed,
+so none is ever held in memory.
+
+Usage:
+    python dbstats.py totalresults_*.json
+    python dbstats.py --threshold 100 --processes 4 --json archive/*.json
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import glob
+import json
+import math
+import multiprocessing
+import os
+import sys
+
+from levels import db_energy, leq
+from sessionfile import iter_readings, read_index
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class SessionAggregate(object):
+    """Mergeable summary of a run of (timestamp, dB) readings."""
+
+    def __init__(self, name='', threshold=100.0, max_gap_ms=5000):
+        """Initialize the SessionAggregate object.
+
+           Parameters
+           ----------
+             name (str) : label for the readings, e.g. the archive name
+             threshold (float) : decibel level used for the time above
+               threshold statistic
+             max_gap_ms (int) : longest interval, in milliseconds, that a
+               single reading is assumed to cover
+        """
+        self.name = name
+        self.threshold = threshold
+        self.max_gap_ms = max_gap_ms
+        self.count = 0
+        self.energy = 0.0
+        self.max_db = None
+        self.max_t = None
+        self.first_t = None
+        self.last_t = None
+        self.ms_above = 0
+        # histogram of readings in 0.1 dB steps, keyed by round(db * 10)
+        self.histogram = {}
+        # per-minute sound energy, keyed by minute since the epoch
+        self.minutes = {}
+        self._last_db = None
+
+    def add(self, t, db):
+        """Fold one reading into the aggregate.
+
+           Readings must be added in chronological order.
+        """
+        energy = db_energy(db)
+        self.count += 1
+        self.energy += energy
+        if self.max_db is None or db > self.max_db:
+            self.max_db, self.max_t = db, t
+        if self.first_t is None:
+            self.first_t = t
+        if self._last_db is not None and self._last_db >= self.threshold:
+            self.ms_above += min(t - self.last_t, self.max_gap_ms)
+        self.last_t, self._last_db = t, db
+        key = int(round(db * 10))
+        self.histogram[key] = self.histogram.get(key, 0) + 1
+        minute = t // 60000
+        e, n = self.minutes.get(minute, (0.0, 0))
+        self.minutes[minute] = (e + energy, n + 1)
+
+    def merge(self, other):
+        """Fold another aggregate into this one and return self."""
+        if not other.count:
+            return self
+        self.count += other.count
+        self.energy += other.energy
+        if self.max_db is None or other.max_db > self.max_db:
+            self.max_db, self.max_t = other.max_db, other.max_t
+        if self.first_t is None or other.first_t < self.first_t:
+            self.first_t = other.first_t
+        if self.last_t is None or other.last_t > self.last_t:
+            self.last_t, self._last_db = other.last_t, other._last_db
+        self.ms_above += other.ms_above
+        for key, n in other.histogram.iteritems():
+            self.histogram[key] = self.histogram.get(key, 0) + n
+        for minute, (e, n) in other.minutes.iteritems():
+            e0, n0 = self.minutes.get(minute, (0.0, 0))
+            self.minutes[minute] = (e0 + e, n0 + n)
+        return self
+
+    def extend(self, other):
+        """Fold in the aggregate of the readings which directly follow
+           this one's, e.g. the next part of the same archive, and return
+           self.
+        """
+        if (other.count and self._last_db is not None and
+                self._last_db >= self.threshold):
+            # the time between the two parts, as `add` would have counted
+            self.ms_above += min(other.first_t - self.last_t,
+                                 self.max_gap_ms)
+        return self.merge(other)
+
+    def leq(self):
+        """Return the equivalent continuous sound level in dB."""
+        return leq(self.energy, self.count)
+
+    def percentile(self, p):
+        """Return the reading below which `p` percent of readings fall."""
+        if not self.count:
+            return None
+        rank = int(math.ceil(p / 100 * self.count))
+        seen = 0
+        for key in sorted(self.histogram):
+            seen += self.histogram[key]
+            if seen >= rank:
+                return key / 10
+        return self.max_db
+
+    def loudest_minute(self):
+        """Return (start time in ms, Leq) of the loudest whole minute."""
+        if not self.minutes:
+            return None, None
+        minute, (e, n) = max(self.minutes.iteritems(),
+                             key=lambda item: item[1][0] / item[1][1])
+        return minute * 60000, leq(e, n)
+
+    def report(self):
+        """Return the summary statistics as a JSON-friendly dict."""
+        minute_t, minute_leq = self.loudest_minute()
+        leq = self.leq()
+        return {
+            'name': self.name,
+            'samples': self.count,
+            'start_ms': self.first_t,
+            'end_ms': self.last_t,
+            'max_db': self.max_db,
+            'max_at_ms': self.max_t,
+            'leq_db': None if leq is None else round(leq, 2),
+            'percentiles': dict((str(p), self.percentile(p))
+                                for p in PERCENTILES),
+            'threshold_db': self.threshold,
+            'seconds_above_threshold': self.ms_above / 1000,
+            'loudest_minute_ms': minute_t,
+            'loudest_minute_leq_db': (None if minute_leq is None
+                                      else round(minute_leq, 2)),
+        }
+
+
+def summarize_file(args):
+    """Worker entry point: summarize a single archive.
+
+       Parameters
+       ----------
+         args (tuple) : path to the archive, dB threshold and maximum
+           gap in milliseconds, packed for use with `Pool.imap_unordered`
+    """
+    path, threshold, max_gap_ms = args
+    return summarize_part((path, threshold, max_gap_ms, 0, 0, None))[2]
+
+
+def summarize_part(args):
+    """Worker entry point: summarize part of an archive.
+
+       Parameters
+       ----------
+         args (tuple) : path to the archive, dB threshold, maximum gap
+           in milliseconds, the part's number and its start and end byte
+           offsets (see `split_archive`)
+
+       Returns
+       -------
+         (tuple) : the path, the part's number and its SessionAggregate
+    """
+    path, threshold, max_gap_ms, part, start, end = args
+    name = os.path.splitext(os.path.basename(path))[0]
+    agg = SessionAggregate(name, threshold=threshold, max_gap_ms=max_gap_ms)
+    # streamed, so a long game is never held in memory as a whole
+    for t, db in iter_readings(path, start, end):
+        agg.add(t, db)
+    return path, part, agg
+
+
+def split_archive(path, parts):
+    """Return (start, end) byte offsets dividing an archive into parts.
+
+       The archive is split at its index points, so an archive without
+       a sidecar index, or a short one, is a single part.
+
+       Parameters
+       ----------
+         path (str) : the archive
+         parts (int) : how many parts to aim for
+    """
+    index = read_index(path)
+    if parts <= 1 or not index or len(index) < 2:
+        return [(0, None)]
+    step = int(math.ceil(len(index) / parts))
+    bounds = [offset for _, offset in index[step::step]]
+    return zip([0] + bounds, bounds + [None])
+
+
+def format_report(report):
+    """Return a one-line, human-readable version of a report dict."""
+    pct = report['percentiles']
+    return ('{name}: {samples} samples, max {max_db} dB, Leq {leq_db} dB, '
+            'L50/L90/L99 {p50}/{p90}/{p99} dB, {above:.0f}s >= '
+            '{threshold_db} dB, loudest minute {loudest_minute_leq_db} dB'
+            ).format(p50=pct['50'], p90=pct['90'], p99=pct['99'],
+                     above=report['seconds_above_threshold'], **report)
+
+
+def iter_summaries(paths, threshold=100.0, max_gap_ms=5000, processes=None):
+    """Yield a SessionAggregate per archive, in order of completion.
+
+       Parameters
+       ----------
+         paths (list) : paths to JSON session archives
+         threshold (float) : decibel level for time above threshold
+         max_gap_ms (int) : longest interval covered by one reading
+         processes (int) : number of worker processes; defaults to the
+           number of CPU cores
+    """
+    # an archive named twice would be counted twice in the season
+    paths = [path for i, path in enumerate(paths) if path not in paths[:i]]
+    if processes == 1:
+        for path in paths:
+            yield summarize_file((path, threshold, max_gap_ms))
+        return
+    workers = processes or multiprocessing.cpu_count()
+    jobs = []
+    # path --> {part number: SessionAggregate} until every part is in
+    parts = {}
+    for path in paths:
+        ranges = split_archive(path, workers)
+        parts[path] = dict.fromkeys(xrange(len(ranges)))
+        jobs.extend((path, threshold, max_gap_ms, part, start, end)
+                    for part, (start, end) in enumerate(ranges))
+    if len(jobs) <= 1:
+        for job in jobs:
+            yield summarize_part(job)[2]
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        for path, part, agg in pool.imap_unordered(summarize_part, jobs):
+            parts[path][part] = agg
+            if any(a is None for a in parts[path].itervalues()):
+                continue
+            done = parts.pop(path)
+            whole = done[0]
+            for part in xrange(1, len(done)):
+                whole.extend(done[part])
+            yield whole
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('paths', nargs='+', metavar='FILE',
+                        help='session archives (wildcards allowed)')
+    parser.add_argument('--threshold', type=float, default=100.0,
+                        help='dB level for time above threshold')
+    parser.add_argument('--max-gap', type=int, default=5000,
+                        help='longest interval (ms) one reading covers')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--json', action='store_true',
+                        help='print one JSON object per line')
+    args = parser.parse_args()
+
+    # the Windows shell doesn't expand wildcards for us
+    paths = []
+    for pattern in args.paths:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    season = SessionAggregate('season', threshold=args.threshold,
+                              max_gap_ms=args.max_gap)
+    for agg in iter_summaries(paths, args.threshold, args.max_gap,
+                              args.processes):
+        report = agg.report()
+        if args.json:
+            print(json.dumps(report, sort_keys=True))
+        else:
+            print(format_report(report))
+        sys.stdout.flush()
+        season.merge(agg)
+    report = season.report()
+    if args.json:
+        print(json.dumps(report, sort_keys=True))
+    else:
+        print(format_report(report))
+
+if __name__ == '__main__':
+    main()
@@ -4,19 +4,36 @@
 """Display current decibel readings with a graphical gauge."""
 
 # XXXX: include timestamps in milliseconds
-# TODO: (interpolated) data points at 15 samples/second
+# XXXX: (interpolated) data points at 15 samples/second
 # XXXX: send most recent 300 samples at a time
 # TODO: upload to FTP once per second
 
-import ftplib
+import backends
 import json
 import math
 import os
 import random
 import sys
 import time
-import Tkinter
-import usb.core
+
+# what every launch needs; optional features (checkpoints, compaction,
+# the outbox, publishing, rate control and upsampling) are imported where
+# they are turned on
+from pipeline import Bus, LevelHistogram, MeterSource, RunningStats
+from bargeometry import bar_geometry, canvas_width
+from history import HistoryStrip
+from meterworker import MeterWorker, WS1361
+from profiling import ProfilerToggle, bind_tk, install_signal
+from scheduler import TkScheduler
+from sessionfile import write_session
+
+# the GUI toolkit, FTP client and optional features are imported on
+# first use
+arena = backends.lazy('arena')
+ftplib = backends.lazy('ftp')
+livefeed = backends.lazy('livefeed')
+sessionstore = backends.lazy('catalog')
+Tkinter = backends.lazy('gui')
 
 try:
     import cStringIO as StringIO
@@ -25,21 +42,35 @@ except ImportError:
     print "Using non-C implementation of StringIO."
 
 try:
-    from ftpconfig import FTP_HOST, FTP_USERNAME, FTP_PASSWORD, FTP_DIR
+    import ftpconfig
 except ImportError:
+    ftpconfig = None
     print "FTP configuration import failed. Saving output locally only."
 
-def fibonacci_number(n):
-    """Return the Nth Fibonacci number."""
-    a, b = 1, 1
-    for _ in xrange(n - 1):
-        a, b = b, a + b
-    return a
+def next_free_filename(filename, ext='.json'):
+    """Return `filename` with the first unused two-digit suffix.
+
+       The directory is listed once rather than probing each candidate
+       name with its own filesystem call.
+
+       Parameters
+       ----------
+         filename (str) : file name, minus suffix and extension
+         ext (str) : file extension
+    """
+    directory = os.path.dirname(filename) or '.'
+    prefix = os.path.basename(filename) + '_'
+    taken = set(name[len(prefix):-len(ext)] for name in os.listdir(directory)
+                if name.startswith(prefix) and name.endswith(ext))
+    idx = 1
+    while str(idx).rjust(2, '0') in taken:
+        idx += 1
+    return '{}_{}'.format(filename, str(idx).rjust(2, '0'))
 
 class FTPConnection(object):
     """FTP connection for uploading files."""
 
-    def __init__(self, host, user, password, directory):
+    def __init__(self, host, user, password, directory, port=21):
         """Initialize the FTP connection object.
 
            Parameters
@@ -48,15 +79,18 @@ class FTPConnection(object):
              user (str) : FTP username
              password (str) : FTP password
              directory (str) : desired FTP subdirectory
+             port (int) : FTP control port, e.g. of an FTPStandIn
         """
         self.host = host
+        self.port = port
         self.user = user
         self.password = password
         self.directory = directory
 
     def __enter__(self):
         # called at the beginning of a 'with' block
-        self.ftp = ftplib.FTP(self.host)
+        self.ftp = ftplib.FTP()
+        self.ftp.connect(self.host, self.port)
         self.ftp.login(self.user, self.password)
         # self.ftp.set_pasv(False)
         return self
@@ -80,12 +114,13 @@ class FTPConnection(object):
         """
         if directory is None:
             directory = self.directory
-        obj = [obj] if isinstance(obj, tuple) else obj
+        obj = [input_obj] if isinstance(input_obj, tuple) else input_obj
         json_string = json.dumps(obj, indent=None, separators=(',', ':'))
         file_string = StringIO.StringIO(json_string)
         self.ftp.cwd(directory)
         print '{}'.format(json_string)
-        self.ftp.storbinary('STOR {}.json'.format(filename), file_string)
+        return self.ftp.storbinary('STOR {}.json'.format(filename),
+                                   file_string)
 
     def send_file(self, filename, ext='.json', directory=None):
         """Upload a plain text file to the specified FTP directory.
@@ -143,6 +178,15 @@ class ReadoutValue(object):
         """
         self.text.set('{} {}'.format(db, self.units))
 
+# heading above the current reading for each meter status
+METER_HEADINGS = {
+    'ok': "Current Decibel Reading:",
+    'demo': "Current Decibel Reading (demo):",
+    'error': "Meter error, last reading:",
+    'stuck': "Meter not responding:",
+    'stale': "No new reading since:",
+}
+
 class DecibelVisualizer(object):
     """Cool-looking way to visualize decibel levels."""
 
@@ -150,7 +194,12 @@ class DecibelVisualizer(object):
                  delay=1000, subintervals=15, title="Live Decibel Reading",
                  units='dB', use_ftp=False, ftp_host='', ftp_username='',
                  ftp_password='', ftp_dir='', fname_send='kubbdbs',
-                 fname_save='totalresults', seconds_between_uploads=1):
+                 fname_save='totalresults', seconds_between_uploads=1,
+                 session_db=None, publisher=None, upload_rate=None,
+                 upload_window=20, upload_max_bytes=65536, outbox=None,
+                 live_feed=None, threaded_meter=False, meter_timeout=0.5,
+                 compaction=None, rate_controller=None, checkpoint=None,
+                 checkpoint_interval=10, reading_source=None):
         """Initialize the DecibelVizualizer widget.
 
            Parameters
@@ -178,10 +227,48 @@ class DecibelVisualizer(object):
                when script is stopped
              seconds_between_uploads (int) : seconds between each attempt
                to send data to the FTP server
+             session_db (str) : path to the SQLite session catalog in
+               which each finished game is recorded, or None
+             publisher (PublisherFanout) : started fan-out which receives
+               the recent readings every `seconds_between_uploads`
+               seconds, or None
+             upload_rate (int) : points per second in the published
+               stream, interpolated between meter readings; None
+               publishes the raw readings
+             upload_window (int) : seconds of upsampled history included
+               in each published payload
+             upload_max_bytes (int) : upper bound on the size of each
+               upsampled payload
+             outbox (Outbox) : durable queue in which every reading is
+               kept until an OutboxDrainer has uploaded it, or None
+             live_feed (str) : path of a memory-mapped file kept up to
+               date with the latest readings for other local programs,
+               or None
+             threaded_meter (boolean) : read the meter on a background
+               thread, so a slow or hung read can't freeze the display?
+             meter_timeout (float) : seconds after which a threaded read
+               still in progress is flagged as stuck
+             compaction (Compactor) : run-length and/or deadband encoding
+               of the saved session and the published stream, or None
+               to write every reading as a [timestamp, dB] pair
+             rate_controller (UploadRateController) : observes the
+               publisher's uploads and sets the interval between them and
+               the seconds of readings in each, in place of
+               `seconds_between_uploads` and `upload_window`; or None
+             checkpoint (str) : path of a file to which the running
+               statistics are saved every `checkpoint_interval` seconds,
+               and from which they're restored on startup; or None
+             checkpoint_interval (float) : seconds between checkpoints
+             reading_source (object) : supplies readings in place of the
+               local meter through the same methods as a MeterWorker,
+               e.g. an arena.ArenaReceiver; or None
         """
         self.parent = parent
         self.parent.wm_title(title)
         self.Canvas = Tkinter.Canvas(parent, width=width, height=height)
+        # whole-game history, drawn below the bars
+        self.history = HistoryStrip(parent, width=width, min_db=min_db,
+                                    max_db=max_db)
         self.w = width
         self.h = height
         self.min_db = float(min_db)
@@ -190,11 +277,18 @@ class DecibelVisualizer(object):
         self.max_scale = max_db + 10
         self.db_current = min_db
         self.db_maximum = min_db
+        # every reading taken since launch, for the archive and catalog;
+        # it has to grow with the game, a few hundred kB an hour
         self.all_dbs = []
         self.to_send = []
+        # the newest readings, for the bars and uploads; after a restart
+        # it also holds the tail restored from the checkpoint
         self.temp_dbs = []
         # live decibel tracking won't happen while self.event is None
         self.event = None
+        # runs acquisition, frames and uploads while tracking is live
+        self.scheduler = None
+        self.last_reading_at = None
         # delay between readings of the USB device, in milliseconds
         self.delay = delay
         # number of times per second that the visualization will refresh
@@ -205,6 +299,8 @@ class DecibelVisualizer(object):
         self.fname_send = fname_send
         # filename for the JSON to be saved locally with all results
         self.fname_save = fname_save
+        # SQLite catalog of finished games
+        self.session_db = session_db
 
         # ftp login credentials
         self.use_ftp = use_ftp
@@ -212,6 +308,42 @@ class DecibelVisualizer(object):
         self.ftp_username = ftp_username
         self.ftp_password = ftp_password
         self.ftp_dir = ftp_dir
+        # fan-out to any number of FTP servers and local directories
+        self.publisher = publisher
+        # server-side upsampling of the published stream
+        self.upload_rate = upload_rate
+        self.upload_window = upload_window
+        self.upload_max_bytes = upload_max_bytes
+        # gap-free record of every reading for the FTP server
+        self.outbox = outbox
+        # memory-mapped latest values for local consumers
+        self.live_feed = live_feed
+        # the USB sound level meter, read on a worker thread if threaded
+        self.device = WS1361()
+        self.threaded_meter = threaded_meter
+        self.meter_timeout = meter_timeout
+        self.meter_worker = None
+        self.reading_source = reading_source
+        # 'ok', 'demo', 'error', 'stuck' or 'stale'; shown in the heading
+        self.meter_status = None
+        # encoding of saved and published readings
+        self.compaction = compaction
+        # adapts the upload cadence to the link, through the publish task
+        self.rate_controller = rate_controller
+        self.publish_task = None
+        # readings kept in temp_dbs: enough for the longest upload window,
+        # plus the one before it, and never fewer than a checkpoint holds
+        window = self.upload_window
+        if rate_controller is not None:
+            window = max(window, rate_controller.max_window)
+        self.recent_limit = max(
+            300, int(math.ceil(window * 1000.0 / self.delay)) + 1)
+        # aggregate state saved regularly, so a restart resumes the game
+        self.checkpoint = None
+        if checkpoint is not None:
+            from checkpoint import Checkpoint
+            self.checkpoint = Checkpoint(checkpoint)
+        self.checkpoint_interval = checkpoint_interval
 
         # if self.use_ftp == True:
         #    self.ftp_connection = FTPConnection(
@@ -234,6 +366,10 @@ class DecibelVisualizer(object):
             1:  '#0341B7',
             0:  '#040AB4',
         }
+        # bins of every bar height, bar positions and the frame, shared
+        # with any other chart of the same size
+        self.geometry = bar_geometry(self.max_scale, self.w, self.colors)
+        self.Canvas.bind('<Configure>', self.resize_chart)
 
         # counters
         self.counter = 0
@@ -273,6 +409,7 @@ class DecibelVisualizer(object):
         parent.grid_columnconfigure(1, weight=1)
         # add widgets to the parent widget's grid
         self.Canvas.grid(row=2, column=1, columnspan=3, rowspan=3)
+        self.history.Canvas.grid(row=5, column=1, columnspan=3, pady=5)
         self.cur_heading.Label.grid(row=0, column=0, columnspan=2, padx=10,
                                     pady=10)
         self.cur_value.Label.grid(row=1, column=0, pady=5)
@@ -286,6 +423,10 @@ class DecibelVisualizer(object):
         self.demo_button.grid(row=3, column=0, padx=10, pady=5)
         self.start_button.grid(row=2, column=0, padx=10, pady=5)
 
+        self._configure_pipeline()
+        if self.checkpoint is not None:
+            self.restore_checkpoint()
+
     def _config_parent():
         """Configure the parent object."""
         pass
@@ -302,6 +443,28 @@ class DecibelVisualizer(object):
         """Configure all buttons."""
         pass
 
+    def _configure_pipeline(self):
+        """Subscribe every consumer of meter readings to the bus.
+
+           Each new reading is delivered to the subscribers in the order
+           they were added, so the statistics are up to date by the time
+           the labels are refreshed.
+        """
+        self.bus = Bus()
+        self.meter = MeterSource(self.bus, self.live_dbs)
+        self.stats = self.bus.subscribe(RunningStats(minimum=self.min_db))
+        self.histogram = self.bus.subscribe(
+            LevelHistogram(self.min_db, self.max_db))
+        self.bus.subscribe(self.record_reading)
+        if self.outbox is not None:
+            self.bus.subscribe(self.outbox)
+        if self.live_feed is not None:
+            self.bus.subscribe(livefeed.LiveFeedWriter(self.live_feed,
+                                                       stats=self.stats))
+        self.bus.subscribe(self.save_recent)
+        self.bus.subscribe(self.history)
+        self.bus.subscribe(self.refresh_labels)
+
     def _send_json_obj_via_ftp(self, input_obj, fname=None):
         """Send a file-like object containing JSON data to an FTP server.
 
@@ -331,7 +494,9 @@ class DecibelVisualizer(object):
         # if we get an error, keep trying:
         except:
             print "Unexpected Error: {}".format(sys.exc_info()[0])
-            wait = (standard_wait + fibonacci_number(self.fibcounter)) * 1000
+            from publishers import MAX_RETRY_WAIT, fibonacci_number
+            wait = min(MAX_RETRY_WAIT, standard_wait +
+                       fibonacci_number(self.fibcounter)) * 1000
             self.Canvas.after(wait, self._send_json_obj_via_ftp,
                               input_obj)
             self.fibcounter += 1
@@ -363,38 +528,39 @@ class DecibelVisualizer(object):
             print "AttributeError: {}".format(e)
         except:
             print 'Unexpected error: {}'.format(sys.exc_info()[0])
-            wait = (standard_wait + fibonacci_number(self.fibcounter)) * 1000
+            from publishers import MAX_RETRY_WAIT, fibonacci_number
+            wait = min(MAX_RETRY_WAIT, standard_wait +
+                       fibonacci_number(self.fibcounter)) * 1000
             self.Canvas.after(wait, self._send_file_via_ftp, fname)
             self.fibcounter += 1
 
     def save_json(self, obj, filename=None, overwrite=False):
-        """Save an object to file in JSON format."""
+        """Save an object to file in JSON format.
+
+           Returns
+           -------
+             (str) : name of the file written, minus extension
+        """
         # convert a single reading to a list
         if isinstance(obj, tuple):
             obj = [obj]
         if filename is None:
             filename = self.fname_save
         if not overwrite:
-            idx = 1
-            while True:
-                str_idx = str(idx).rjust(2, '0')
-                fname = '{}_{}'.format(filename, str_idx)
-                if os.path.isfile(fname + '.json'):
-                    idx += 1
-                else:
-                    filename = fname
-                    break
-        # the overwritten file should be as small as possible for FTP
+            filename = next_free_filename(filename)
+        # the overwritten file should be as small as possible for FTP;
+        # the archive gets an index so it can be read from any time on
         indent = 3 if not overwrite else None
-        json_output = json.dumps(obj, indent=indent, separators=(',', ':'))
-        with open(filename + '.json', 'w+') as stream:
-            stream.write(json_output)
+        write_session(filename + '.json', obj, indent=indent,
+                      index=not overwrite)
+        return filename
 
     def live_dbs(self, lower_bound=None, upper_bound=None):
         """Return the live decibel reading from the USB device.
 
-           Credit for decoding the WENSN WS1361 Sound Meter belongs to
-           Troy Simpson: http://opensource.ebswift.com/RaspiMonitor/wensn/
+           Random readings are only returned while no meter has ever
+           been found. Once it has been, a failed read raises instead of
+           passing off a made-up value as a measurement.
 
            Parameters
            ----------
@@ -413,28 +579,29 @@ class DecibelVisualizer(object):
         if upper_bound is None:
             upper_bound = self.max_db
         try:
-            # identify the usb device
-            dev = usb.core.find(idVendor=0x16c0, idProduct=0x5dc)
-            # decipher its signal
-            ret = dev.ctrl_transfer(0xC0, 4, 0, 0, 200)
-            db = (ret[0] + ((ret[1] & 3) * 256)) * 0.1 + 30
-            db_as_string = '{0:.2f}'.format(float(db))
-            return float(db_as_string)
-        # allow a demo mode in case the demo mode isn't connected.
-        except AttributeError:
-            return float('{0:.2f}'.format(
-                    float(random.randrange(lower_bound, upper_bound))))
-        except Exception as e:
-            print "Unknown exception: {}".format(e)
-            return float('{0:.2f}'.format(
-                    float(random.randrange(lower_bound, upper_bound))))
+            return self.device.read()
+        except Exception:
+            if self.device.found:
+                raise
+        # allow a demo mode if pyusb isn't installed or the meter isn't
+        # connected.
+        return float('{0:.2f}'.format(
+                float(random.randrange(lower_bound, upper_bound))))
+
+    def resize_chart(self, event):
+        """Switch to the bar geometry for the canvas's new width.
+
+           The next frame is drawn with it.
+        """
+        width = canvas_width(event)
+        if width == self.w:
+            return
+        self.w = width
+        self.geometry = bar_geometry(self.max_scale, self.w, self.colors)
 
     def draw_frame(self):
         """Draw the frame and labels."""
-        x1, y1 = 10, 10
-        x2, y2 = 10, self.max_scale
-        x3, y3 = self.w, self.max_scale
-        self.Canvas.create_line(x1, y1, x2, y2, x3, y3, fill='black')
+        self.Canvas.create_line(*self.geometry.frame, fill='black')
 
     def draw_one_bar(self, bar_height=130, bar_width=20, left_edge=20):
         """Draw a single bar composed of colored bins.
@@ -446,23 +613,11 @@ class DecibelVisualizer(object):
              left_edge (int) : horizontal position of the bar's left edge,
                in pixels
         """
-        # incremental height -- a bar is built up bin by bin
-        inc_height = 0
-        for i in range(0, int(bar_height) / 10 + 1):
-            # the topmost bin will often be shorter than the usual bin height
-            dif = bar_height - (i * 10)
-            bin_height = min([dif, 10])
-            col = self.colors[i]
-            # define the top-left and bottom right corners of the bin
-            x1, y1 = left_edge, self.max_scale - ((i * 10) + bin_height)
-            x2, y2 = left_edge + bar_width, self.max_scale - (i * 10)
-
-            inc_height += bin_height
-            if inc_height > bar_height:
-                break
-
-            # draw a single bin
-            self.Canvas.create_rectangle(x1, y1, x2, y2, fill=col)
+        right_edge = left_edge + bar_width
+        # the bins' corners and colors come ready-made from the table
+        for y1, y2, col in self.geometry.bar(bar_height):
+            self.Canvas.create_rectangle(left_edge, y1, right_edge, y2,
+                                         fill=col)
 
     def draw_multiple_bars(self, list_of_height_edge_tuples):
         """Draw multiple, potentially different, bars at once.
@@ -486,7 +641,7 @@ class DecibelVisualizer(object):
              bar_height (float, int) : height of the bars
         """
         self.draw_multiple_bars(
-            [(bar_height, e) for e in [20+i*30 for i in range(0,10)]])
+            [(bar_height, e) for e in self.geometry.edges])
 
     def draw_interpolated_individual_bars(self, subcounter=None):
         """Draw ten bars which show smooth transitions between values.
@@ -498,23 +653,25 @@ class DecibelVisualizer(object):
         """
         if subcounter is None:
             subcounter = self.subcounter
+        # number of bars to be drawn (ten is default)
+        num = 10
+        # only the newest readings are ever drawn, so don't interpolate
+        # between the rest
+        needed = (num + subcounter) // self.subintervals + 2
+        recent = self.temp_dbs[-needed:]
         # create a list of tuples representing all measurement pairs
         # e.g. [0, 1, 2, 3] --> [(0, 1), (1, 2), (2, 3)]
-        tup_list = [(self.all_dbs[i][1], self.all_dbs[i+1][1])
-                    for i in range(len(self.all_dbs) - 1)]
+        tup_list = [(recent[i][1], recent[i+1][1])
+                    for i in range(len(recent) - 1)]
         # create a new list with finer-grained intervals by interpolating
         # between each measurement pair in tup_list
         int_list = []
         for a, b in tup_list:
             vals = self.interpolate_two_values(a, b)
             int_list += vals
-        # number of bars to be drawn (ten is default)
-        num = 10
         # the zip here joins a list of ten heights to a list of ten edges
         self.draw_multiple_bars(
-            [(v, e) for (v, e) in zip(
-                int_list[-(num + subcounter):],
-                [20+i*30 for i in range(0, 10)])])
+            zip(int_list[-(num + subcounter):], self.geometry.edges))
 
     def interpolate_two_values(self, val_a, val_b, subintervals=None):
         """Return a list of values evenly spaced between two values.
@@ -537,9 +694,8 @@ class DecibelVisualizer(object):
         # Unix timestamp in milliseconds
         unix_time = int(round(time.time() * 1000))
         new = (unix_time, self.live_dbs())
-        self.all_dbs.append(new)
-        self.temp_dbs.append(new)
-        self.ftpcounter += 1
+        self.record_reading(new)
+        self.stats(new)
         if self.use_ftp == True:
             if self.ftpcounter % self.seconds_between_uploads == 0:
                 #data_to_send = self.all_dbs[-300:] if len(
@@ -549,32 +705,79 @@ class DecibelVisualizer(object):
         self.update_stats()
 
     def fetch_new_reading(self):
-        """Get a new reading from the decibel meter."""
-        # Unix timestamp in milliseconds
-        unix_time = int(round(time.time() * 1000))
-        new = (unix_time, self.live_dbs())
-        self.all_dbs.append(new)
-        self.temp_dbs.append(new)
+        """Get a new reading from the decibel meter and publish it."""
+        return self.meter.poll()
+
+    def record_reading(self, reading):
+        """Add a reading to the session history."""
+        self.all_dbs.append(reading)
+        self.temp_dbs.append(reading)
+        # trim in batches, so each reading costs O(1) on average
+        if len(self.temp_dbs) > 2 * self.recent_limit:
+            del self.temp_dbs[:-self.recent_limit]
         self.ftpcounter += 1
 
-        if len(self.temp_dbs) > 300:
-            json_data = self.temp_dbs[-300:]
-        else:
-            json_data = self.temp_dbs
+    def recent_readings(self, count=300):
+        """Return the most recent `count` readings."""
+        return self.temp_dbs[-count:]
 
-        # if len(self.all_dbs) >= 300:
-        #    self.save_json(self.all_dbs, self.fname_save)
-        #    self.all_dbs = []
+    def save_recent(self, reading):
+        """Overwrite the local file of recent readings."""
+        self.save_json(self.compact(self.recent_readings()),
+                       filename=self.fname_send, overwrite=True)
 
-        self.save_json(json_data, filename=self.fname_send,
-                       overwrite=True)
-        if self.use_ftp == True:
-            if self.ftpcounter % self.seconds_between_uploads == 0:
-                self._send_file_via_ftp(fname=self.fname_send)
+    def compact(self, readings):
+        """Return readings encoded for saving or publishing.
+
+           `compaction.expand` turns the result back into (timestamp, dB)
+           tuples.
+        """
+        if self.compaction is None:
+            return readings
+        return self.compaction(readings)
+
+    def upload_recent(self, reading=None):
+        """Send the recent readings to the publisher or FTP server."""
+        if self.publisher is not None and self.rate_controller is not None:
+            interval, window = self.rate_controller.current()
+            count = int(math.ceil(window * 1000.0 / self.delay))
+            self.publisher.publish(self.publish_payload(
+                self.recent_readings(count), window=window))
+            # the next upload happens after the controller's interval
+            if self.publish_task is not None:
+                self.publish_task.period = interval
+        elif self.publisher is not None:
+            # hands off to the sinks' own threads and never blocks
+            self.publisher.publish(
+                self.publish_payload(self.recent_readings()))
+        elif self.use_ftp == True:
+            self._send_file_via_ftp(fname=self.fname_send)
+
+    def refresh_labels(self, reading):
+        """Show the latest statistics once a reading has been handled."""
         self.update_stats()
 
+    def publish_payload(self, recent, window=None):
+        """Return what should be published for the latest readings.
+
+           Parameters
+           ----------
+             recent (list) : most recent raw readings
+             window (float) : seconds of upsampled readings to include;
+               defaults to `upload_window`
+        """
+        if window is None:
+            window = self.upload_window
+        if not self.upload_rate:
+            return self.compact(recent)
+        from upsample import windowed_payload
+        return windowed_payload(
+            self.temp_dbs, rate=self.upload_rate, interval_ms=self.delay,
+            window_ms=window * 1000,
+            max_bytes=self.upload_max_bytes, encode=self.compaction)
+
     def live_display(self, subintervals=None):
-        """Monitor live decibel readings and plot with smoothness.
+        """Draw one frame, reading the meter once every `subintervals`.
 
            Parameters
            ----------
@@ -583,8 +786,7 @@ class DecibelVisualizer(object):
         """
         if subintervals is None:
             subintervals = self.subintervals
-        delay = self.delay / subintervals
-        if len(self.all_dbs) >= 2:
+        if len(self.temp_dbs) >= 2:
             # the USB meter's refresh rate and the subcounter are in sync
             self.subcounter = self.counter % subintervals
             # clear the canvas before drawing any new bars
@@ -602,17 +804,12 @@ class DecibelVisualizer(object):
             self.fetch_new_reading()
             # self.fetch_new_reading_and_send_string()
             self.counter += 1
-        # call this function recursively, if desired
-        if self.event:
-            self.Canvas.after(delay, self.live_display)
 
     def update_stats(self):
         """Update labels with new information."""
-        self.db_current = self.all_dbs[-1][1]
-        temp_average = sum(
-            [e[1] for e in self.all_dbs]) / float(len(self.all_dbs))
-        self.db_average = float('{0:.2f}'.format(temp_average))
-        self.db_maximum = max(self.db_current, self.db_maximum)
+        self.db_current = self.stats.current
+        self.db_average = self.stats.average
+        self.db_maximum = self.stats.maximum
         self.cur_value.update(self.db_current)
         self.avg_value.update(self.db_average)
         self.max_value.update(self.db_maximum)
@@ -622,7 +819,152 @@ class DecibelVisualizer(object):
         if ms_between_readings is None:
             ms_between_readings = self.delay
         self.event = 'something'
-        self.live_display()
+        self.scheduler = TkScheduler(self.Canvas)
+        self.schedule_tasks(self.scheduler, ms_between_readings)
+        self.scheduler.start()
+
+    def schedule_tasks(self, scheduler, ms_between_readings=None):
+        """Add acquisition, frame and publishing tasks to a scheduler.
+
+           Parameters
+           ----------
+             scheduler (DeadlineScheduler) : runs the tasks
+             ms_between_readings (int) : delay between meter readings
+        """
+        if ms_between_readings is None:
+            ms_between_readings = self.delay
+        self.scheduler = scheduler
+        period = ms_between_readings / 1000.0
+        # frames come first so that the frame sharing a deadline with a
+        # reading still shows the end of the previous transition
+        self.scheduler.every(period / self.subintervals, self.render_frame,
+                             name='frame')
+        if self.reading_source is not None:
+            self.meter_worker = self.reading_source.start()
+        elif self.threaded_meter:
+            self.meter_worker = MeterWorker(
+                self.device, clock=self.meter.clock,
+                timeout=self.meter_timeout, stale_after=3 * period,
+                min_db=int(self.min_db), max_db=int(self.max_db)).start()
+        if self.meter_worker is not None:
+            self.scheduler.every(period, self.request_reading,
+                                 name='acquire')
+            # completed readings are picked up at the frame rate
+            self.scheduler.every(period / self.subintervals,
+                                 self.collect_readings, name='collect')
+        else:
+            self.scheduler.every(period, self.acquire, name='acquire')
+        upload_period = self.seconds_between_uploads
+        self.publish_task = self.scheduler.every(
+            upload_period, self.upload_recent, name='publish',
+            delay=upload_period)
+        if self.checkpoint is not None:
+            self.scheduler.every(self.checkpoint_interval,
+                                 self.save_checkpoint, name='checkpoint',
+                                 delay=self.checkpoint_interval)
+
+    def acquire(self):
+        """Read the meter and note when, for the frames that follow."""
+        # only the meter is judged here; the bus deals with its
+        # subscribers' failures
+        try:
+            reading = self.meter.read()
+        except Exception as e:
+            self.flag_meter('error', '{}: {}'.format(type(e).__name__, e))
+            return
+        self.flag_meter('ok' if self.device.found else 'demo')
+        self.last_reading_at = self.scheduler.clock()
+        self.bus.publish(reading)
+
+    def request_reading(self):
+        """Ask the meter worker for a reading without waiting for it."""
+        # a read still in progress isn't doubled up; collect_readings
+        # flags it once it has overrun its timeout
+        self.meter_worker.request()
+
+    def collect_readings(self):
+        """Publish the readings the meter worker has completed."""
+        for status, unix_time, value in self.meter_worker.poll():
+            if status == 'error':
+                self.flag_meter(status, value)
+                continue
+            self.flag_meter(status)
+            self.last_reading_at = self.scheduler.clock()
+            # safe to call: the bus deals with its subscribers' failures
+            self.bus.publish((unix_time, value))
+        if self.meter_worker.stuck():
+            self.flag_meter('stuck')
+        elif self.meter_worker.stale() and self.meter_status != 'error':
+            self.flag_meter('stale')
+
+    def flag_meter(self, status, detail=None):
+        """Show in the heading whether the current reading can be trusted.
+
+           Parameters
+           ----------
+             status (str) : 'ok', 'demo' (random values, no meter found),
+               'error' (the last read failed), 'stuck' (a read has hung
+               past its timeout) or 'stale' (no reading for a while)
+             detail (str) : description of an error
+        """
+        if status == self.meter_status:
+            return
+        self.meter_status = status
+        self.cur_heading.Label.config(text=METER_HEADINGS[status])
+        if status != 'ok':
+            print 'Meter {}{}'.format(
+                status, ': {}'.format(detail) if detail else '')
+
+    def render_frame(self):
+        """Draw the bars for the current point between two readings."""
+        if len(self.temp_dbs) < 2 or self.last_reading_at is None:
+            return
+        frame_period = self.delay / 1000.0 / self.subintervals
+        elapsed = self.scheduler.clock() - self.last_reading_at
+        frames = int(round(elapsed / frame_period))
+        # a late reading holds the bars at the newest one rather than
+        # starting the slide over
+        self.subcounter = min(frames, self.subintervals - 1)
+        self.clear()
+        self.draw_interpolated_individual_bars()
+
+    def checkpoint_state(self):
+        """Return the session's aggregate state as a JSON-ready dict.
+
+           Its size doesn't depend on the length of the game.
+        """
+        return {'stats': self.stats.state(),
+                'histogram': self.histogram.state(),
+                'history': self.history.history.state(),
+                'recent': self.recent_readings(),
+                'ftpcounter': self.ftpcounter}
+
+    def save_checkpoint(self):
+        """Write the aggregate state to the checkpoint file."""
+        self.checkpoint.save(self.checkpoint_state())
+
+    def restore_checkpoint(self):
+        """Resume from the checkpoint file, if there's a recent one.
+
+           Returns
+           -------
+             (boolean) : was a checkpoint restored?
+        """
+        state = self.checkpoint.load()
+        if state is None:
+            return False
+        self.stats.restore(state['stats'])
+        self.histogram.restore(state['histogram'])
+        self.history.restore(state['history'])
+        # the tail keeps the bars, interpolation and uploads going; it
+        # stays out of all_dbs, so the archive and catalog hold only the
+        # readings taken since the restart
+        self.temp_dbs = [tuple(reading) for reading in state['recent']]
+        self.ftpcounter = state['ftpcounter']
+        self.update_stats()
+        print 'Resumed from checkpoint: {} readings, maximum {} dB'.format(
+            self.stats.seen, self.stats.maximum)
+        return True
 
     def clear(self):
         """Remove existing bars from the visualizer and redraw the frame."""
@@ -635,27 +977,139 @@ class DecibelVisualizer(object):
             filename = self.fname_save
         self.use_ftp = False
         self.event = None
-        self.save_json(obj=self.all_dbs, filename=filename, overwrite=False)
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            print self.scheduler.report()
+            self.scheduler = None
+        if self.meter_worker is not None:
+            self.meter_worker.stop()
+            self.meter_worker = None
+        if self.rate_controller is not None:
+            print self.rate_controller.format_stats()
+        if self.publisher is not None:
+            print self.publisher.format_stats()
+            self.publisher.stop()
+            self.publisher = None
+        if self.outbox is not None:
+            # the drainer keeps uploading what's left in the background
+            self.outbox.roll()
+        saved = self.save_json(obj=self.compact(self.all_dbs),
+                               filename=filename, overwrite=False)
+        if self.session_db is not None and self.all_dbs:
+            name = os.path.splitext(os.path.basename(saved))[0]
+            try:
+                with sessionstore.SessionStore(self.session_db) as store:
+                    store.add_game(name, self.all_dbs)
+            except sessionstore.Error as e:
+                # the archive is saved; it can be imported later
+                print 'Could not add {} to the catalog: {}'.format(name, e)
+        if self.checkpoint is not None:
+            # the game is over; the next launch starts a new one
+            self.checkpoint.clear()
 
 def main():
+    args = sys.argv[1:]
+    timing = '--timing' in args
     root = Tkinter.Tk()
-    root.geometry('570x330+30+30')
-    if len(sys.argv) == 2:
-        if sys.argv[1] == '--ftp':
-            g = DecibelVisualizer(
-                    root, use_ftp=True, ftp_host=FTP_HOST,
-                    ftp_username=FTP_USERNAME, ftp_password=FTP_PASSWORD,
-                    ftp_dir=FTP_DIR)
-    else:
-        g = DecibelVisualizer(root, use_ftp=False)
+    root.geometry('570x400+30+30')
+    publisher = outbox = rate_controller = upload_rate = None
+    if '--ftp' in args and ftpconfig is not None:
+        from outbox import Outbox, OutboxDrainer
+        from publishers import ftp_sink_from_config, publisher_from_config
+        from ratecontrol import UploadRateController
+        # primary and backup FTP servers plus a local directory, as
+        # configured in ftpconfig.py
+        publisher = publisher_from_config(ftpconfig).start()
+        # the primary server's uploads set the pace for all of them
+        rate_controller = publisher.observe(UploadRateController(),
+                                            name='primary')
+        # every reading also goes to the primary server in numbered
+        # segments, including any left over from an earlier run
+        sink = ftp_sink_from_config(ftpconfig)
+        if sink is not None:
+            outbox = Outbox('outbox')
+            OutboxDrainer(outbox, sink).start()
+        # the live stream is upsampled to 15 readings per second
+        upload_rate = int(option(args, 'upload-rate', '15') or 15)
+    # everything else is opt-in, so a plain launch loads and writes
+    # nothing it doesn't need
+    g = DecibelVisualizer(root, use_ftp=False, session_db='sessions.db',
+                          publisher=publisher, upload_rate=upload_rate,
+                          outbox=outbox,
+                          live_feed=option(args, 'live-feed',
+                                           'kubbdbs.live'),
+                          threaded_meter='--threaded-meter' in args,
+                          compaction=compaction_from_args(args),
+                          rate_controller=rate_controller,
+                          checkpoint=option(args, 'checkpoint',
+                                            'kubbdbs.checkpoint'),
+                          reading_source=arena_from_args(args))
     g.draw_frame()
     # have the app open with some nice-looking bars on the screen
     g.draw_multiple_bars(
         [(105, 20), (115, 50), (125, 80), (121, 110), (120, 140),
          (119, 170), (118, 200), (115, 230), (112, 260), (108, 290)]
         )
-
+    # F9 (or SIGUSR1 / Ctrl+Break) starts and stops the profiler
+    profiler = ProfilerToggle(
+        mode='cprofile' if '--cprofile' in args else 'sampling')
+    bind_tk(root, profiler)
+    install_signal(profiler)
+
+    backends.mark('widgets built')
+    if timing:
+        root.after_idle(print_timing_report)
     root.mainloop()
 
+def option(args, name, default):
+    """Return VALUE for `--name=VALUE`, `default` for a bare `--name`,
+       or None if the option wasn't given.
+    """
+    for arg in args:
+        if arg == '--' + name:
+            return default
+        if arg.startswith('--' + name + '='):
+            return arg.split('=', 1)[1]
+    return None
+
+def compaction_from_args(args):
+    """Return the Compactor asked for on the command line, or None.
+
+       `--run-length` folds runs of identical readings losslessly;
+       `--deadband=DB[:MS]` also drops readings within DB decibels of the
+       last one kept, keeping one at least every MS milliseconds.
+    """
+    run_length = '--run-length' in args
+    deadband_db = deadband_ms = None
+    for arg in args:
+        if arg.startswith('--deadband='):
+            values = arg.split('=', 1)[1].split(':')
+            deadband_db = float(values[0])
+            if len(values) > 1:
+                deadband_ms = int(values[1])
+    if not run_length and deadband_db is None:
+        return None
+    from compaction import Compactor
+    return Compactor(run_length=run_length, deadband_db=deadband_db,
+                     deadband_ms=deadband_ms)
+
+def arena_from_args(args):
+    """Return an ArenaReceiver if `--arena[=PORT]` was given, or None.
+
+       The display then shows the arena-wide level combined from the
+       reader hosts instead of reading a local meter.
+    """
+    for arg in args:
+        if arg == '--arena':
+            return arena.ArenaReceiver(arena.DEFAULT_PORT)
+        if arg.startswith('--arena='):
+            return arena.ArenaReceiver(int(arg.split('=', 1)[1]))
+    return None
+
+def print_timing_report():
+    """Print how long each step of startup took."""
+    backends.mark('main loop running')
+    print backends.timing_report()
+
 if __name__ == '__main__':
     main()
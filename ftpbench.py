@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark the upload path against an FTP stand-in with injected faults.
+
+For each fault profile, payloads shaped like the live stream are published
+through a PublisherFanout to an FTPStandIn for a fixed time. The faults
+are then cleared and publishing continues until an upload gets through.
+Reported per profile:
+
+    throughput  bytes per second stored on the server while faulty
+    lag         seconds from queueing a payload to its delivery
+                (mean, 95th percentile, maximum)
+    recovery    seconds from clearing the faults to the next delivery
+
+Usage:
+    python ftpbench.py --seconds 20
+    python ftpbench.py --adaptive --profiles clean,drops,outage
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import collections
+import json
+import sys
+import threading
+import time
+
+from ftpstandin import Faults, FTPStandIn
+from publishers import FTPSink, PublisherFanout
+from ratecontrol import UploadRateController
+
+# name --> keyword arguments for Faults
+PROFILES = collections.OrderedDict([
+    ('clean', {}),
+    ('latency', {'latency': 0.15}),
+    ('narrow', {'bandwidth': 8 * 1024}),
+    ('drops', {'drop_rate': 0.3}),
+    ('refused', {'refuse_rate': 0.3}),
+    ('slow226', {'slow_226': 1.5}),
+    ('outage', {'refuse_rate': 1.0}),
+])
+
+
+def payload(now, readings=300, interval_ms=1000):
+    """Return a JSON payload like the live stream's, ending at `now`."""
+    end = int(now * 1000)
+    return json.dumps([(end - i * interval_ms, 85.5)
+                       for i in xrange(readings - 1, -1, -1)],
+                      separators=(',', ':'))
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Results(object):
+    """Outcome of every send, collected from the publisher's worker."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sends = []
+
+    def __call__(self, ok, duration, lag, size):
+        with self.lock:
+            self.sends.append((time.time(), ok, duration, lag, size))
+
+    def between(self, start, end):
+        with self.lock:
+            return [s for s in self.sends if start <= s[0] < end]
+
+
+def run_profile(faults, seconds=20, interval=1.0, readings=300,
+                adaptive=False, recovery_limit=60):
+    """Publish through a faulty stand-in and measure the upload path.
+
+       Parameters
+       ----------
+         faults (Faults) : faults injected while measuring
+         seconds (float) : how long to publish with the faults in place
+         interval (float) : seconds between payloads, unless adaptive
+         readings (int) : readings per payload
+         adaptive (boolean) : let an UploadRateController set the pace?
+         recovery_limit (float) : give up waiting for recovery after
+           this many seconds
+
+       Returns
+       -------
+         (dict) : sends, failures, throughput, lag statistics and
+           recovery time
+    """
+    standin = FTPStandIn(faults=faults).start()
+    host, port = standin.address
+    publisher = PublisherFanout()
+    worker = publisher.add_sink(
+        FTPSink(host, standin.user, standin.password, 'live', port=port,
+                timeout=10, name='standin'), retry_wait=0)
+    results = worker.observe(Results())
+    controller = None
+    if adaptive:
+        controller = worker.observe(UploadRateController())
+    publisher.start()
+    try:
+        began = time.time()
+        cleared = recovered = None
+        while True:
+            now = time.time()
+            if cleared is None and now - began >= seconds:
+                standin.faults = Faults()
+                cleared = now
+            if cleared is not None:
+                recovered = next((s[0] for s in results.between(
+                    cleared, now + 1) if s[1]), None)
+                if recovered is not None or now - cleared > recovery_limit:
+                    break
+            publisher.publish(payload(now, readings))
+            wait = controller.current()[0] if controller else interval
+            time.sleep(max(0.0, wait - (time.time() - now)))
+        sends = results.between(began, cleared)
+        with standin.lock:
+            stored = sum(size for t, _, size, _ in standin.uploads
+                         if t < cleared)
+        lags = [s[3] for s in sends if s[1]]
+        return {
+            'sends': len(sends),
+            'failures': sum(1 for s in sends if not s[1]),
+            'dropped': worker.dropped,
+            'throughput': stored / seconds,
+            'lag_mean': sum(lags) / len(lags) if lags else None,
+            'lag_p95': percentile(lags, 95),
+            'lag_max': max(lags) if lags else None,
+            'recovery': (None if recovered is None
+                         else recovered - cleared),
+            'rate': controller.format_stats() if controller else None,
+        }
+    finally:
+        publisher.stop(timeout=1)
+        standin.stop()
+
+
+def format_seconds(value):
+    return '-' if value is None else '{:.2f}'.format(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=20,
+                        help='seconds of publishing per fault profile')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between payloads')
+    parser.add_argument('--readings', type=int, default=300,
+                        help='readings per payload')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='pace uploads with an UploadRateController')
+    parser.add_argument('--profiles', default=','.join(PROFILES),
+                        help='comma-separated profiles to run, from: ' +
+                             ', '.join(PROFILES))
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON lines')
+    args = parser.parse_args()
+
+    names = args.profiles.split(',')
+    unknown = [name for name in names if name not in PROFILES]
+    if unknown:
+        parser.error('unknown profiles: {}'.format(', '.join(unknown)))
+    if not args.json:
+        print('{:<9} {:>5} {:>6} {:>7} {:>10} {:>6} {:>6} {:>6} {:>8}'
+              .format('profile', 'sends', 'failed', 'dropped', 'B/s',
+                      'lag', 'p95', 'max', 'recovery'))
+    for name in names:
+        result = run_profile(Faults(seed=0, **PROFILES[name]), args.seconds,
+                             args.interval, args.readings, args.adaptive)
+        if args.json:
+            result['profile'] = name
+            print(json.dumps(result, sort_keys=True))
+            continue
+        print('{:<9} {:>5} {:>6} {:>7} {:>10.0f} {:>6} {:>6} {:>6} {:>8}'
+              .format(name, result['sends'], result['failures'],
+                      result['dropped'], result['throughput'],
+                      format_seconds(result['lag_mean']),
+                      format_seconds(result['lag_p95']),
+                      format_seconds(result['lag_max']),
+                      format_seconds(result['recovery'])))
+        if result['rate']:
+            print('          ' + result['rate'])
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A small in-process FTP server standing in for the real one.
+
+It understands just enough of the protocol for `ftplib` uploads (login,
+CWD, passive-mode STOR and RETR) and keeps uploaded files in memory, so
+the upload path can be exercised offline without touching the arena's
+server:
+
+    server = FTPStandIn().start()
+    host, port = server.address
+    ...
+    server.stop()
+
+To reproduce a bad link, give it a Faults object, or swap `faults` while
+it runs: every reply can be delayed, data connections capped to a
+bandwidth, uploads cut off partway through, logins refused and the final
+`226` reply held back.
+
+    server.faults = Faults(latency=0.2, drop_rate=0.3)
+"""
+
+from __future__ import print_function, division
+
+import posixpath
+import random
+import socket
+import SocketServer
+import threading
+import time
+
+
+class Faults(object):
+    """Faults injected by the stand-in into every connection."""
+
+    def __init__(self, latency=0.0, bandwidth=None, drop_rate=0.0,
+                 drop_after=1024, refuse_rate=0.0, slow_226=0.0, seed=None):
+        """Initialize the Faults object.
+
+           Parameters
+           ----------
+             latency (float) : seconds added before every reply
+             bandwidth (int) : bytes per second allowed on each data
+               connection, or None for no cap
+             drop_rate (float) : fraction of uploads cut off, closing the
+               control and data connections without a final reply
+             drop_after (int) : bytes received before an upload is cut off
+             refuse_rate (float) : fraction of logins refused with 530
+             slow_226 (float) : seconds before the reply confirming an
+               upload
+             seed (int) : seed for choosing which uploads and logins fail
+        """
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.drop_rate = drop_rate
+        self.drop_after = drop_after
+        self.refuse_rate = refuse_rate
+        self.slow_226 = slow_226
+        self.random = random.Random(seed)
+
+    def refuse_login(self):
+        """Decide whether to refuse a login."""
+        return self.random.random() < self.refuse_rate
+
+    def drop_upload(self):
+        """Decide whether to cut off an upload."""
+        return self.random.random() < self.drop_rate
+
+
+class FTPHandler(SocketServer.StreamRequestHandler):
+    """Serve one FTP control connection."""
+
+    def reply(self, line):
+        latency = self.server.standin.faults.latency
+        if latency:
+            time.sleep(latency)
+        self.wfile.write(line + '\r\n')
+        self.wfile.flush()
+
+    def handle(self):
+        self.cwd = '/'
+        self.user = None
+        self.logged_in = False
+        self.data_listener = None
+        self.reply('220 Stand-in FTP server ready.')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            cmd, _, arg = line.strip().partition(' ')
+            method = getattr(self, 'ftp_' + cmd.upper(), None)
+            if method is None:
+                self.reply('502 Command not implemented.')
+            elif not self.logged_in and cmd.upper() not in (
+                    'USER', 'PASS', 'QUIT'):
+                self.reply('530 Please log in.')
+            elif method(arg) is False:
+                break
+        self._close_data_listener()
+
+    def _path(self, name):
+        return posixpath.normpath(posixpath.join(self.cwd, name))
+
+    def _close_data_listener(self):
+        if self.data_listener is not None:
+            self.data_listener.close()
+            self.data_listener = None
+
+    def _accept_data(self):
+        """Accept the client's connection to the passive data socket."""
+        if self.data_listener is None:
+            self.reply('425 Use PASV first.')
+            return None
+        self.data_listener.settimeout(self.server.standin.timeout)
+        try:
+            conn, _ = self.data_listener.accept()
+        except socket.timeout:
+            self.reply('425 Data connection timed out.')
+            return None
+        finally:
+            self._close_data_listener()
+        return conn
+
+    def ftp_USER(self, arg):
+        self.user = arg
+        self.reply('331 Password required.')
+
+    def ftp_PASS(self, arg):
+        standin = self.server.standin
+        if standin.faults.refuse_login():
+            standin.refused += 1
+            self.reply('530 Login incorrect.')
+        elif self.user == standin.user and arg == standin.password:
+            self.logged_in = True
+            self.reply('230 Logged in.')
+        else:
+            self.reply('530 Login incorrect.')
+
+    def ftp_QUIT(self, arg):
+        self.reply('221 Goodbye.')
+        return False
+
+    def ftp_SYST(self, arg):
+        self.reply('215 UNIX Type: L8')
+
+    def ftp_NOOP(self, arg):
+        self.reply('200 OK.')
+
+    def ftp_TYPE(self, arg):
+        self.reply('200 Type set to {}.'.format(arg))
+
+    def ftp_PWD(self, arg):
+        self.reply('257 "{}"'.format(self.cwd))
+
+    def ftp_CWD(self, arg):
+        # directories are created implicitly by uploading into them
+        self.cwd = self._path(arg)
+        self.reply('250 Directory changed.')
+
+    def ftp_PASV(self, arg):
+        self._close_data_listener()
+        host = self.server.server_address[0]
+        self.data_listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.data_listener.bind((host, 0))
+        self.data_listener.listen(1)
+        port = self.data_listener.getsockname()[1]
+        self.reply('227 Entering Passive Mode ({},{},{}).'.format(
+            host.replace('.', ','), port // 256, port % 256))
+
+    def ftp_STOR(self, arg):
+        conn = self._accept_data()
+        if conn is None:
+            return
+        standin = self.server.standin
+        faults = standin.faults
+        drop = faults.drop_upload()
+        self.reply('150 Ok to send data.')
+        began = time.time()
+        chunks = []
+        received = 0
+        try:
+            while True:
+                chunk = conn.recv(self._chunk_size(faults.bandwidth))
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                received += len(chunk)
+                if drop and received >= faults.drop_after:
+                    break
+                self._throttle(faults.bandwidth, received, began)
+        finally:
+            conn.close()
+        if drop:
+            # hang up on the client without confirming anything
+            standin.dropped += 1
+            return False
+        standin.store(self._path(arg), ''.join(chunks), time.time() - began)
+        if faults.slow_226:
+            time.sleep(faults.slow_226)
+        self.reply('226 Transfer complete.')
+
+    @staticmethod
+    def _chunk_size(bandwidth):
+        # small reads under a cap, so the throttle can keep pace
+        if bandwidth is None:
+            return 8192
+        return max(1, min(8192, bandwidth // 10))
+
+    @staticmethod
+    def _throttle(bandwidth, transferred, began):
+        """Sleep until `transferred` bytes fit within the bandwidth cap."""
+        if bandwidth is None:
+            return
+        ahead = transferred / bandwidth - (time.time() - began)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    def ftp_RETR(self, arg):
+        data = self.server.standin.files.get(self._path(arg))
+        if data is None:
+            self._close_data_listener()
+            self.reply('550 No such file.')
+            return
+        conn = self._accept_data()
+        if conn is None:
+            return
+        self.reply('150 Opening data connection.')
+        bandwidth = self.server.standin.faults.bandwidth
+        began = time.time()
+        try:
+            size = self._chunk_size(bandwidth)
+            for start in xrange(0, len(data), size):
+                conn.sendall(data[start:start + size])
+                self._throttle(bandwidth, start + size, began)
+        finally:
+            conn.close()
+        self.reply('226 Transfer complete.')
+
+
+class FTPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FTPStandIn(object):
+    """In-process FTP server which keeps uploaded files in memory."""
+
+    def __init__(self, host='127.0.0.1', port=0, user='user',
+                 password='password', timeout=10, faults=None):
+        """Initialize the FTPStandIn object.
+
+           Parameters
+           ----------
+             host (str) : interface to listen on
+             port (int) : port to listen on; 0 picks a free one
+             user (str) : the only accepted username
+             password (str) : the only accepted password
+             timeout (int) : seconds to wait for a data connection
+             faults (Faults) : faults to inject; None for a clean link
+        """
+        self.user = user
+        self.password = password
+        self.timeout = timeout
+        self.faults = faults or Faults()
+        self.lock = threading.Lock()
+        # path --> contents of the latest upload
+        self.files = {}
+        # (time received, path, bytes, seconds spent receiving)
+        self.uploads = []
+        # uploads cut off and logins refused by injected faults
+        self.dropped = 0
+        self.refused = 0
+        self.server = FTPServer((host, port), FTPHandler)
+        self.server.standin = self
+        self.thread = None
+
+    @property
+    def address(self):
+        """(host, port) that clients should connect to."""
+        return self.server.server_address
+
+    def start(self):
+        """Start serving in a background thread and return self."""
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='ftp-standin')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the listening socket."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def store(self, path, data, duration):
+        """Record an upload; called by the connection handlers."""
+        with self.lock:
+            self.files[path] = data
+            self.uploads.append((time.time(), path, len(data), duration))
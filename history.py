@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Whole-game history chart, decimated to one column per pixel.
+
+Drawing every reading of a long game each frame would get slower as the
+game goes on. Instead, readings are folded as they arrive into at most
+`width` columns, each holding the minimum and maximum of the readings it
+covers. When the columns run out, neighbouring pairs are merged and each
+column then covers twice as many readings, so the chart always spans the
+whole game and redrawing it costs the same however long the game is.
+"""
+
+from __future__ import print_function, division
+
+import backends
+
+Tkinter = backends.lazy('gui')
+
+
+class MinMaxHistory(object):
+    """Min/max-per-column decimation of a growing series of readings."""
+
+    def __init__(self, width):
+        """Initialize the MinMaxHistory object.
+
+           Parameters
+           ----------
+             width (int) : greatest number of columns kept
+        """
+        self.width = max(2, width)
+        # readings folded into each column
+        self.per_column = 1
+        self.mins = []
+        self.maxes = []
+        # readings folded into the newest column so far
+        self.filled = 0
+
+    def add(self, db):
+        """Fold one reading into the newest column."""
+        if self.mins and self.filled < self.per_column:
+            if db < self.mins[-1]:
+                self.mins[-1] = db
+            if db > self.maxes[-1]:
+                self.maxes[-1] = db
+            self.filled += 1
+            return
+        if len(self.mins) == self.width:
+            self._halve()
+            return self.add(db)
+        self.mins.append(db)
+        self.maxes.append(db)
+        self.filled = 1
+
+    def _halve(self):
+        """Merge neighbouring columns, doubling the readings per column."""
+        mins, maxes = self.mins, self.maxes
+        self.mins = [min(mins[i:i + 2]) for i in xrange(0, len(mins), 2)]
+        self.maxes = [max(maxes[i:i + 2]) for i in xrange(0, len(maxes), 2)]
+        # merged columns are full, except a lone last column left over
+        # when the count was odd
+        self.filled = self.per_column * (1 if len(mins) % 2 else 2)
+        self.per_column *= 2
+
+    def __len__(self):
+        return len(self.mins)
+
+    def state(self):
+        """Return the columns as a dict, e.g. for a checkpoint."""
+        return {'per_column': self.per_column, 'filled': self.filled,
+                'mins': list(self.mins), 'maxes': list(self.maxes)}
+
+    def restore(self, state):
+        """Continue from columns returned by `state`."""
+        self.per_column = state['per_column']
+        self.filled = state['filled']
+        self.mins = list(state['mins'])
+        self.maxes = list(state['maxes'])
+        while len(self.mins) > self.width:
+            self._halve()
+
+    def coords(self, left, bottom, height, min_db, max_db):
+        """Return flat polyline coordinates tracing every column.
+
+           Each column becomes a vertical stroke from its maximum to its
+           minimum, so one line item draws the whole envelope.
+
+           Parameters
+           ----------
+             left (int) : x position of the first column, in pixels
+             bottom (int) : y position of `min_db`, in pixels
+             height (int) : pixels between `min_db` and `max_db`
+             min_db (float) : level drawn at the bottom
+             max_db (float) : level drawn at the top
+        """
+        scale = height / (max_db - min_db)
+        coords = []
+        for i, (lo, hi) in enumerate(zip(self.mins, self.maxes)):
+            x = left + i
+            coords.extend((x, bottom - (hi - min_db) * scale,
+                           x, bottom - (lo - min_db) * scale))
+        return coords
+
+
+class HistoryStrip(object):
+    """Canvas strip showing the whole game's history as one line."""
+
+    def __init__(self, parent, width=320, height=60, min_db=30, max_db=130,
+                 color='#037ABB'):
+        """Initialize the HistoryStrip object.
+
+           Parameters
+           ----------
+             parent (Tkinter widget) : the parent widget
+             width (int) : width of the strip in pixels
+             height (int) : height of the strip in pixels
+             min_db (int) : level drawn at the bottom of the strip
+             max_db (int) : level drawn at the top of the strip
+             color (str) : color of the history line
+        """
+        self.w = width
+        self.h = height
+        self.min_db = float(min_db)
+        self.max_db = float(max_db)
+        self.Canvas = Tkinter.Canvas(parent, width=width, height=height)
+        # leave the same margin as the bar chart's frame
+        self.left = 10
+        self.history = MinMaxHistory(width - self.left)
+        self.Canvas.create_line(self.left, 0, self.left, height - 1,
+                                width, height - 1, fill='black')
+        # the line item is created once and only its coordinates change
+        self.line = self.Canvas.create_line(self.left, height - 1,
+                                            self.left, height - 1,
+                                            fill=color)
+
+    def __call__(self, reading):
+        """Add a (timestamp, dB) reading, so a strip can join a Bus."""
+        self.add(reading[1])
+
+    def add(self, db):
+        """Add a reading and redraw the history line."""
+        self.history.add(db)
+        self.redraw()
+
+    def restore(self, state):
+        """Continue from a `MinMaxHistory.state` and redraw."""
+        self.history.restore(state)
+        self.redraw()
+
+    def redraw(self):
+        """Move the history line's points to match the history."""
+        coords = self.history.coords(self.left, self.h - 1, self.h - 2,
+                                     self.min_db, self.max_db)
+        if len(coords) >= 4:
+            self.Canvas.coords(self.line, *coords)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Decibel arithmetic shared by the session catalog and the arena.
+
+Decibels are logarithmic, so levels are averaged by their sound energy
+rather than directly. This module needs nothing beyond `math`, so the
+reader and aggregator can use it without loading sqlite3.
+"""
+
+from __future__ import print_function, division
+
+import math
+
+
+def db_energy(db):
+    """Return the relative sound energy of a decibel reading."""
+    return 10 ** (db / 10)
+
+
+def leq(energy, count):
+    """Return the equivalent continuous sound level (Leq) in dB.
+
+       Parameters
+       ----------
+         energy (float) : sum of `db_energy` over all readings
+         count (int) : number of readings
+    """
+    if not count or energy <= 0:
+        return None
+    return float('{0:.2f}'.format(10 * math.log10(energy / count)))
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Memory-mapped file of the latest readings for local consumers.
+
+Programs on the same machine (a scoreboard overlay, video graphics) can
+map this file once and poll it as often as they like, with no JSON
+parsing and no reopening. The layout is fixed, little-endian:
+
+    offset  type        field
+         0  char[4]     magic, 'DBLV'
+         4  uint32      layout version (1)
+         8  uint32      capacity N of the reading ring
+        12  uint32      reserved
+        16  uint64      sequence counter; odd while an update is written
+        24  uint64      total readings written
+        32  float64     current reading, dB
+        40  float64     average, dB
+        48  float64     maximum, dB
+        56  uint64      readings included in the average
+        64  N x {int64 timestamp in ms, float64 dB}
+
+Reading `i` (counting from zero since the writer started) lives in ring
+slot `i % N`. Readers use the sequence counter as a seqlock: read it, copy
+what they need, read it again, and retry if it changed or was odd. When
+the app restarts it carries on from the sequence counter left in the
+file, so a value a reader saw before the restart never comes round
+again; the readings count and the ring start over.
+"""
+
+from __future__ import print_function, division
+
+import mmap
+import os
+import struct
+import time
+
+MAGIC = 'DBLV'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+SEQ = struct.Struct('<Q')
+STATE = struct.Struct('<QdddQ')
+SLOT = struct.Struct('<qd')
+SEQ_OFFSET = 16
+STATE_OFFSET = 24
+RING_OFFSET = 64
+
+
+def file_size(capacity):
+    """Return the size in bytes of a feed holding `capacity` readings."""
+    return RING_OFFSET + capacity * SLOT.size
+
+
+class LiveFeedWriter(object):
+    """Publish readings and statistics into the memory-mapped file."""
+
+    def __init__(self, path, capacity=64, stats=None):
+        """Initialize the LiveFeedWriter object, creating the file.
+
+           Parameters
+           ----------
+             path (str) : location of the feed file
+             capacity (int) : number of recent readings kept
+             stats (RunningStats) : source of the current, average and
+               maximum values; if None, only the readings are published
+        """
+        self.path = path
+        self.capacity = capacity
+        self.stats = stats
+        self.count = 0
+        size = file_size(capacity)
+        # Windows can't truncate a file that a reader still has mapped,
+        # so a file of the right size from an earlier run is reused
+        if not (os.path.isfile(path) and os.path.getsize(path) == size):
+            with open(path, 'wb') as stream:
+                stream.write('\0' * size)
+        self.stream = open(path, 'r+b')
+        self.map = mmap.mmap(self.stream.fileno(), size)
+        # carry on from an earlier run's sequence, which is odd if it
+        # stopped partway through an update, so readers never see it
+        # repeat; a new file starts at zero
+        self.seq = SEQ.unpack_from(self.map, SEQ_OFFSET)[0]
+        self.seq += self.seq % 2
+        # readers see an update in progress while the file is reset
+        self.seq += 1
+        SEQ.pack_into(self.map, SEQ_OFFSET, self.seq)
+        self.map[STATE_OFFSET:] = '\0' * (size - STATE_OFFSET)
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, capacity, 0)
+        self.seq += 1
+        SEQ.pack_into(self.map, SEQ_OFFSET, self.seq)
+
+    def __call__(self, reading):
+        """Publish a reading, so a writer can subscribe to a Bus."""
+        self.write(reading)
+
+    def write(self, reading):
+        """Store a (timestamp, dB) reading and the current statistics."""
+        stats = self.stats
+        # odd sequence: readers back off until the update is complete
+        self.seq += 1
+        SEQ.pack_into(self.map, SEQ_OFFSET, self.seq)
+        SLOT.pack_into(self.map, RING_OFFSET +
+                       (self.count % self.capacity) * SLOT.size,
+                       reading[0], reading[1])
+        self.count += 1
+        if stats is None:
+            STATE.pack_into(self.map, STATE_OFFSET, self.count, reading[1],
+                            0.0, 0.0, 0)
+        else:
+            STATE.pack_into(self.map, STATE_OFFSET, self.count,
+                            stats.current, stats.average, stats.maximum,
+                            stats.seen)
+        self.seq += 1
+        SEQ.pack_into(self.map, SEQ_OFFSET, self.seq)
+
+    def close(self):
+        """Unmap and close the file; readers keep the last values."""
+        self.map.close()
+        self.stream.close()
+
+
+class LiveFeedReader(object):
+    """Poll the memory-mapped file written by LiveFeedWriter."""
+
+    def __init__(self, path):
+        """Initialize the LiveFeedReader object.
+
+           Parameters
+           ----------
+             path (str) : location of the feed file
+
+           Raises
+           ------
+             ValueError : the file isn't a feed file
+        """
+        self.stream = open(path, 'rb')
+        size = os.fstat(self.stream.fileno()).st_size
+        self.map = mmap.mmap(self.stream.fileno(), size,
+                             access=mmap.ACCESS_READ)
+        magic, version, self.capacity, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a live feed file'.format(path))
+
+    def _consistent(self, read):
+        """Call `read` until it completes without a concurrent update."""
+        while True:
+            before = SEQ.unpack_from(self.map, SEQ_OFFSET)[0]
+            if before % 2:
+                time.sleep(0)
+                continue
+            result = read()
+            if SEQ.unpack_from(self.map, SEQ_OFFSET)[0] == before:
+                return before, result
+
+    def latest(self):
+        """Return the newest (timestamp, dB) reading, or None."""
+        def read():
+            count = STATE.unpack_from(self.map, STATE_OFFSET)[0]
+            if not count:
+                return None
+            return SLOT.unpack_from(self.map, RING_OFFSET + (
+                (count - 1) % self.capacity) * SLOT.size)
+        return self._consistent(read)[1]
+
+    def read(self, last=None):
+        """Return a consistent snapshot of the feed.
+
+           Parameters
+           ----------
+             last (int) : number of recent readings to include; defaults
+               to all that are available
+
+           Returns
+           -------
+             (dict) : sequence counter, total readings written, current,
+               average and maximum dB, readings in the average, and a list
+               of recent (timestamp, dB) readings, oldest first
+        """
+        def read():
+            count, current, average, maximum, seen = STATE.unpack_from(
+                self.map, STATE_OFFSET)
+            n = min(count, self.capacity)
+            if last is not None:
+                n = min(n, last)
+            readings = [SLOT.unpack_from(self.map, RING_OFFSET + (
+                i % self.capacity) * SLOT.size)
+                for i in xrange(count - n, count)]
+            return {'count': count, 'current': current, 'average': average,
+                    'maximum': maximum, 'seen': seen, 'readings': readings}
+        seq, snapshot = self._consistent(read)
+        snapshot['seq'] = seq
+        return snapshot
+
+    def close(self):
+        """Unmap and close the file."""
+        self.map.close()
+        self.stream.close()
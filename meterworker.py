@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Read the USB sound level meter without blocking the GUI.
+
+A `ctrl_transfer` that runs into its timeout, or a slow `usb.core.find`,
+would freeze the Tk animation if called from the main loop. MeterWorker
+performs reads on its own thread; the main loop asks for a reading with
+`request()` and later picks up whatever has completed with `poll()`. A
+read still running after `timeout` seconds is reported as stuck, and the
+meter is reported as stale when no reading has completed for a while.
+Failed reads are reported as errors rather than replaced with made-up
+values; random demo values are only used when no meter has ever been
+found, and are labelled as such.
+"""
+
+from __future__ import print_function, division
+
+import Queue
+import random
+import threading
+import time
+
+import backends
+from scheduler import monotonic
+
+usb_core = backends.lazy('usb')
+
+
+class WS1361(object):
+    """Wensn WS1361 sound level meter on the USB bus.
+
+       Credit for decoding the WENSN WS1361 Sound Meter belongs to
+       Troy Simpson: http://opensource.ebswift.com/RaspiMonitor/wensn/
+    """
+
+    def __init__(self):
+        self.dev = None
+        self.found = False
+
+    def read(self):
+        """Return the current reading in dB.
+
+           Raises
+           ------
+             ImportError : pyusb isn't installed
+             IOError : the meter isn't connected
+             usb.core.USBError : the transfer failed or timed out
+        """
+        if self.dev is None:
+            self.dev = usb_core.find(idVendor=0x16c0, idProduct=0x5dc)
+            if self.dev is None:
+                raise IOError('meter not connected')
+            self.found = True
+        try:
+            ret = self.dev.ctrl_transfer(0xC0, 4, 0, 0, 200)
+        except Exception:
+            # look the device up again next time, e.g. after replugging
+            self.dev = None
+            raise
+        db = (ret[0] + ((ret[1] & 3) * 256)) * 0.1 + 30
+        return float('{0:.2f}'.format(float(db)))
+
+
+class MeterWorker(object):
+    """Background thread taking meter readings on request."""
+
+    def __init__(self, meter=None, clock=time.time, timeout=0.5,
+                 stale_after=3.0, min_db=30, max_db=130):
+        """Initialize the MeterWorker object.
+
+           Parameters
+           ----------
+             meter (WS1361) : the meter; anything with a `read()` method
+               and a `found` attribute will do
+             clock (function) : returns the current Unix time in seconds,
+               used to timestamp readings
+             timeout (float) : seconds after which a read still in
+               progress is reported as stuck
+             stale_after (float) : seconds without a completed reading
+               after which the meter is reported as stale
+             min_db (int) : lowest demo reading
+             max_db (int) : highest demo reading
+        """
+        self.meter = meter or WS1361()
+        self.clock = clock
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.min_db = min_db
+        self.max_db = max_db
+        self.results = Queue.Queue()
+        self.wanted = threading.Event()
+        self.running = False
+        self.thread = None
+        # monotonic time the read in progress began, or None
+        self.started_at = None
+        self.last_success = None
+
+    def start(self):
+        """Start the worker thread and return self."""
+        self.running = True
+        self.last_success = monotonic()
+        self.thread = threading.Thread(target=self._run, name='meter')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """Ask the worker thread to finish after its current read."""
+        self.running = False
+        self.wanted.set()
+
+    def request(self):
+        """Ask for a reading without waiting for it.
+
+           Returns
+           -------
+             (bool) : False if the previous read hasn't finished yet, in
+               which case no new read is queued
+        """
+        if self.started_at is not None or self.wanted.is_set():
+            return False
+        self.wanted.set()
+        return True
+
+    def stuck(self):
+        """Return True if the read in progress has exceeded the timeout."""
+        started_at = self.started_at
+        return (started_at is not None and
+                monotonic() - started_at > self.timeout)
+
+    def stale(self):
+        """Return True if no reading has completed for too long."""
+        return (self.last_success is not None and
+                monotonic() - self.last_success > self.stale_after)
+
+    def poll(self):
+        """Return the results completed since the last poll.
+
+           Returns
+           -------
+             (list) : 3-tuples of a status, a Unix timestamp in ms and a
+               value. The status is 'ok' with a dB value, 'demo' with a
+               random dB value when no meter has ever been found, or
+               'error' with a description of what went wrong.
+        """
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except Queue.Empty:
+                return results
+
+    def _run(self):
+        while True:
+            self.wanted.wait()
+            if not self.running:
+                return
+            self.started_at = monotonic()
+            self.wanted.clear()
+            try:
+                result = ('ok', self.meter.read())
+            except Exception as e:
+                if self.meter.found:
+                    result = ('error', '{}: {}'.format(type(e).__name__, e))
+                else:
+                    # no meter at all: demo mode
+                    result = ('demo', float('{0:.2f}'.format(float(
+                        random.randrange(self.min_db, self.max_db)))))
+            t = int(round(self.clock() * 1000))
+            if result[0] != 'error':
+                self.last_success = monotonic()
+            self.started_at = None
+            self.results.put((result[0], t, result[1]))
@@ -14,7 +14,7 @@
 
 from __future__ import print_function, division
 
-import ftplib
+import backends
 import itertools
 import json
 import math
@@ -24,8 +24,19 @@ import random
 import sys
 import threading
 import time
-import Tkinter
-import usb.core
+
+from bargeometry import bar_geometry, canvas_width
+from history import HistoryStrip
+from pipeline import Bus, MeterSource, QueueSink
+from profiling import ProfilerToggle, bind_tk, install_signal
+from scheduler import DeadlineScheduler, TkScheduler
+
+# the GUI toolkit, FTP client, USB driver and arena link are imported on
+# first use
+arena = backends.lazy('arena')
+ftplib = backends.lazy('ftp')
+Tkinter = backends.lazy('gui')
+usb_core = backends.lazy('usb')
 
 try:
     import cStringIO as StringIO
@@ -73,12 +84,12 @@ class DecibelDataObject(object):
 
     def __enter__(self):
         # open the context manager
-        json_string = json.dumps(self.tups, indent=None
+        json_string = json.dumps(self.tups, indent=None,
                                  separators=(',', ':'))
         self.file_like_obj = StringIO.StringIO(json_string)
         return self
 
-    def __exit__(self):
+    def __exit__(self, *args, **kwargs):
         # close the context manager
         try:
             self.file_like_obj.close()
@@ -128,7 +139,7 @@ class DBMeterReader(object):
         """
         try:
             # identify the usb device
-            dev = usb.core.find(idVendor=0x16c0, idProduct=0x5dc)
+            dev = usb_core.find(idVendor=0x16c0, idProduct=0x5dc)
             # decipher its signal
             ret = dev.ctrl_transfer(0xc0, 4, 0, 0, 200)
             db = (ret[0] + ((ret[1] & 3) * 256)) * 0.1 + 30
@@ -164,7 +175,7 @@ class FTPUploader(object):
         self.ftp.login(self.user, self.password)
         return self
 
-    def __exit__(self):
+    def __exit__(self, *args, **kwargs):
         """docstring"""
         try:
             self.ftp.quit()
@@ -235,7 +246,7 @@ class GuiDisplay(object):
     seen = 0
     total = 0
     window_width = 650
-    window_height = 330
+    window_height = 400
     x_pos = 30
     y_pos = 30
     colors = {
@@ -287,6 +298,14 @@ class GuiDisplay(object):
         self.parent.wm_title(self.title)
         self.Canvas = Tkinter.Canvas(self.parent, width=self.width,
                                      height=self.height)
+        # bins of every bar height, bar positions and the frame, shared
+        # with any other chart of the same size
+        self.geometry = bar_geometry(self.max_db + 10, self.width,
+                                     self.colors)
+        self.Canvas.bind('<Configure>', self.resize_chart)
+        # whole-game history, drawn below the bars
+        self.history = HistoryStrip(self.parent, width=self.width,
+                                    min_db=self.min_db, max_db=self.max_db)
 
     def _configure_labels(self):
         """Configure labels and text."""
@@ -331,6 +350,7 @@ class GuiDisplay(object):
 
         # add the canvas to the parent widget's grid
         self.Canvas.grid(row=2, column=1, columnspan=3, rowspan=3)
+        self.history.Canvas.grid(row=5, column=1, columnspan=3, pady=5)
 
         # add labels and headings
         self.cur_heading.Label.grid(
@@ -357,12 +377,21 @@ class GuiDisplay(object):
         for h, e in list_of_bars:
             self.draw_one_bar(bar_height=h, left_edge=e)
 
+    def resize_chart(self, event):
+        """Switch to the bar geometry for the canvas's new width.
+
+           The next frame is drawn with it.
+        """
+        width = canvas_width(event)
+        if width == self.width:
+            return
+        self.width = width
+        self.geometry = bar_geometry(self.max_db + 10, self.width,
+                                     self.colors)
+
     def draw_frame(self):
         """Draw the frame for the decibel visualization."""
-        x1, y1 = 10, 10
-        x2, y2 = 10, self.max_db + 10
-        x3, y3 = self.width, self.max_db + 10
-        self.Canvas.create_line(x1, y1, x2, y2, x3, y3, fill='black')
+        self.Canvas.create_line(*self.geometry.frame, fill='black')
 
     def clear_bars(self):
         """Remove existing bars from the visualizer and redraw the frame."""
@@ -379,23 +408,11 @@ class GuiDisplay(object):
              left_edge (int) : horizontal position of the bar's leftmost
                edge, in pixels
         """
-        # incremental height -- a bar is built up bin by bin
-        inc_height = 0
-        for i in range(0, int(bar_height) // 10 + 1):
-            # the topmost bin will often be shorter than the usual bar height
-            dif = bar_height - (i * 10)
-            bin_height = min([dif, 10])
-            col = self.colors[i]
-            # a bin is a rectangle defined by top-left and bottom-right pts
-            x1, y1 = left_edge, (self.max_db + 10) - ((i * 10) + bin_height)
-            x2, y2 = left_edge + bar_width, (self.max_db + 10) - (i * 10)
-
-            inc_height += bin_height
-            if inc_height > bar_height:
-                break
-
-            # draw one bin
-            self.Canvas.create_rectangle(x1, y1, x2, y2, fill=col)
+        right_edge = left_edge + bar_width
+        # the bins' corners and colors come ready-made from the table
+        for y1, y2, col in self.geometry.bar(bar_height):
+            self.Canvas.create_rectangle(left_edge, y1, right_edge, y2,
+                                         fill=col)
 
     def draw_multiple_bars(self, list_of_heights):
         """Draw multiple bars at once, from right to left.
@@ -404,7 +421,7 @@ class GuiDisplay(object):
            ----------
              list_of_heights (list) :
         """
-        bars = zip(list_of_heights[::-1], [20+i*30 for i in range(9, -1, -1)])
+        bars = zip(reversed(list_of_heights), self.geometry.right_to_left)
         for (height, edge) in bars:
             self.draw_one_bar(bar_height=height, left_edge=edge)
 
@@ -416,6 +433,7 @@ class GuiDisplay(object):
                 t, db = self.queue.get(0)
                 print(t, db)
                 self.add_to_temp(db)
+                self.history.add(db)
                 self.update_stats(db)
                 self.clear_bars()
                 self.draw_multiple_bars(self.temp)
@@ -442,15 +460,40 @@ class GuiDisplay(object):
             self.temp = self.temp[-10:]
         return self.temp
 
+    def checkpoint_state(self):
+        """Return the running statistics and bars as a JSON-ready dict."""
+        return {'seen': self.seen, 'total': self.total,
+                'db_maximum': self.db_maximum, 'temp': list(self.temp),
+                'history': self.history.history.state()}
+
+    def restore_state(self, state):
+        """Continue from a dict returned by `checkpoint_state`."""
+        self.seen = state['seen']
+        self.total = state['total']
+        self.db_maximum = state['db_maximum']
+        self.temp = list(state['temp'])
+        self.history.restore(state['history'])
+        if self.seen:
+            self.db_average = float('{0:.2f}'.format(self.total / self.seen))
+            self.avg_value.update(self.db_average)
+            self.max_value.update(self.db_maximum)
+        if self.temp:
+            self.cur_value.update(self.temp[-1])
+            self.clear_bars()
+            self.draw_multiple_bars(self.temp)
+
 class DecibelReaderMainApp(object):
     """docstring for DecibelReaderMainApp"""
 
-    def __init__(self, **kwargs):
+    def __init__(self, checkpoint=None, checkpoint_interval=10, **kwargs):
         """Initialize the DecibelReaderMainApp object.
 
            Parameters
            ----------
-             arg (type) :
+             checkpoint (str) : path of a file to which the display's
+               statistics are saved every `checkpoint_interval` seconds,
+               and from which they're restored on startup; or None
+             checkpoint_interval (float) : seconds between checkpoints
         """
         self.root = Tkinter.Tk()
         self._configure_queues()
@@ -459,6 +502,15 @@ class DecibelReaderMainApp(object):
         self.gui = GuiDisplay(parent=self.root, queue=self.raw_db_queue,
                               start_command=self._start,
                               stop_command=self._shutdown)
+        self.checkpoint = None
+        if checkpoint is not None:
+            from checkpoint import Checkpoint
+            self.checkpoint = Checkpoint(checkpoint)
+        self.checkpoint_interval = checkpoint_interval
+        if self.checkpoint is not None:
+            state = self.checkpoint.load()
+            if state is not None:
+                self.gui.restore_state(state)
 
         # set up threads and start them
         #self._configure_threads()
@@ -468,6 +520,9 @@ class DecibelReaderMainApp(object):
     def _configure_queues(self):
         """Configure the Queues for data input and data output."""
         self.raw_db_queue = Queue.Queue()
+        # every reading goes out on the bus; the GUI gets it via its queue
+        self.bus = Bus()
+        self.bus.subscribe(QueueSink(self.raw_db_queue))
         #self.smoothed_db_queue = Queue.Queue()
         #self.ftp_queue = Queue.Queue()
 
@@ -477,36 +532,78 @@ class DecibelReaderMainApp(object):
         self.db_thread.start()
 
     def _periodic_call(self):
-        """Check every 100ms if there is something new in the queue."""
+        """Check every 125ms if there is something new in the queue."""
         self.gui.process_incoming()
         if not self.running:
             sys.exit(1)
-        self.root.after(125, self._periodic_call)
 
     def _start(self):
         """Start running the app."""
         self.running = 1
         self._configure_threads()
-        self._periodic_call()
+        self.gui_scheduler = TkScheduler(self.root)
+        self.gui_scheduler.every(0.125, self._periodic_call, name='frame')
+        if self.checkpoint is not None:
+            self.gui_scheduler.every(self.checkpoint_interval,
+                                     self.save_checkpoint,
+                                     name='checkpoint',
+                                     delay=self.checkpoint_interval)
+        self.gui_scheduler.start()
+
+    def save_checkpoint(self):
+        """Write the display's statistics to the checkpoint file."""
+        # once stopped, don't bring back the checkpoint _shutdown removed
+        if self.running:
+            self.checkpoint.save(self.gui.checkpoint_state())
 
     def _shutdown(self):
         """Safely stop all running processes."""
         self.running = 0
+        if self.checkpoint is not None:
+            # the game is over; the next launch starts a new one
+            self.checkpoint.clear()
 
     def get_dbs(self):
-        """Fetch time/decibel readings and add to Queue."""
-        while self.running:
-            self.DBReader = DBMeterReader(queue=self.raw_db_queue)
-            self.DBReader.produce_data()
-            time.sleep(1)
+        """Fetch time/decibel readings and publish them on the bus."""
+        self.DBReader = DBMeterReader(queue=self.raw_db_queue)
+        source = MeterSource(self.bus, self.DBReader._db_value)
+        scheduler = DeadlineScheduler()
+        scheduler.every(1, source.poll, name='acquire')
+        scheduler.run(lambda: self.running)
 
     def send_output(self):
         """Handle the thread for sending decibel data via FTP."""
         pass
 
 def main():
-    app = DecibelReaderMainApp()
+    options = dict(arg[2:].split('=', 1) for arg in sys.argv[1:]
+                   if arg.startswith('--') and '=' in arg)
+    # --checkpoint[=PATH] saves the statistics regularly, so a restart
+    # resumes the game
+    checkpoint = options.get('checkpoint')
+    if '--checkpoint' in sys.argv[1:]:
+        checkpoint = 'multithreaddbv.checkpoint'
+    app = DecibelReaderMainApp(checkpoint=checkpoint)
+    # --send-to=HOST:PORT --host-id=N also sends every reading to an
+    # arena aggregator (see arena.py)
+    if 'send-to' in options:
+        app.bus.subscribe(arena.SampleSender(
+            int(options.get('host-id', 1)),
+            arena.parse_address(options['send-to'])))
+    # F9 (or SIGUSR1 / Ctrl+Break) starts and stops the profiler
+    profiler = ProfilerToggle(
+        mode='cprofile' if '--cprofile' in sys.argv[1:] else 'sampling')
+    bind_tk(app.root, profiler)
+    install_signal(profiler)
+    backends.mark('widgets built')
+    if '--timing' in sys.argv[1:]:
+        app.root.after_idle(print_timing_report)
     app.root.mainloop()
 
+def print_timing_report():
+    """Print how long each step of startup took."""
+    backends.mark('main loop running')
+    print(backends.timing_report())
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Durable outbox of readings waiting to be uploaded.
+
+Every reading is appended to a numbered segment file on disk as one line
+of compact JSON. Once a segment holds `segment_readings` readings it is
+closed and a new one started. Closed segments stay on disk until an
+upload of them succeeds, so readings taken while the FTP server is
+unreachable, or before the app was restarted, still reach the server.
+After reconnecting, the backlog goes out in large batches at a controlled
+rate. Uploaded batches are named after their first and last segment
+numbers (e.g. `kubbdbs_seg_00000012-00000019.json`), so the server side
+can reassemble a complete record and see any gap.
+
+The outbox is bounded: past `max_bytes`, the oldest segments are dropped
+and counted.
+"""
+
+from __future__ import print_function, division
+
+import json
+import os
+import re
+import threading
+import time
+
+SEGMENT_RE = re.compile(r'^seg_(\d{8})\.log$')
+
+
+class Outbox(object):
+    """Append-only segment files of pending readings."""
+
+    def __init__(self, directory='outbox', segment_readings=15,
+                 max_bytes=20 * 1024 * 1024, fsync=False):
+        """Initialize the Outbox object, picking up any leftover segments.
+
+           Parameters
+           ----------
+             directory (str) : where segment files are kept
+             segment_readings (int) : readings per segment file
+             max_bytes (int) : most disk space the outbox may use
+             fsync (boolean) : force every reading to disk? Safer against
+               power loss, but slow on old hardware
+        """
+        self.directory = directory
+        self.segment_readings = segment_readings
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.dropped_segments = 0
+        self.dropped_bytes = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # sequence number --> size in bytes, for every segment on disk
+        self.sizes = {}
+        for name in os.listdir(directory):
+            match = SEGMENT_RE.match(name)
+            if match:
+                self.sizes[int(match.group(1))] = os.path.getsize(
+                    os.path.join(directory, name))
+        # kept up to date, so appending never re-adds every segment
+        self.total_bytes = sum(self.sizes.itervalues())
+        # never append to a segment left over from an earlier run
+        self.current = max(self.sizes) + 1 if self.sizes else 1
+        self.current_count = 0
+        self.stream = None
+
+    def path(self, seq):
+        """Return the file name of a segment."""
+        return os.path.join(self.directory, 'seg_{:08d}.log'.format(seq))
+
+    def __call__(self, reading):
+        """Append a reading, so an Outbox can subscribe to a Bus."""
+        self.append(reading)
+
+    def append(self, reading):
+        """Durably record one (timestamp, dB) reading.
+
+           Parameters
+           ----------
+             reading (tuple) : a Unix timestamp in milliseconds and a
+               decibel reading
+        """
+        line = json.dumps(reading, separators=(',', ':')) + '\n'
+        with self.lock:
+            if self.stream is None:
+                self.stream = open(self.path(self.current), 'ab')
+            self.stream.write(line)
+            self.stream.flush()
+            if self.fsync:
+                os.fsync(self.stream.fileno())
+            self.sizes[self.current] = (self.sizes.get(self.current, 0) +
+                                        len(line))
+            self.total_bytes += len(line)
+            self.current_count += 1
+            if self.current_count >= self.segment_readings:
+                self._roll()
+            self._enforce_limit()
+
+    def roll(self):
+        """Close the current segment so that it can be uploaded."""
+        with self.lock:
+            self._roll()
+
+    def _roll(self):
+        if self.stream is None:
+            return
+        self.stream.close()
+        self.stream = None
+        self.current += 1
+        self.current_count = 0
+
+    def _enforce_limit(self):
+        while self.total_bytes > self.max_bytes:
+            oldest = min(self.sizes)
+            if oldest == self.current:
+                break
+            size = self.sizes.pop(oldest)
+            self.total_bytes -= size
+            self.dropped_bytes += size
+            self.dropped_segments += 1
+            os.remove(self.path(oldest))
+            print('Outbox full; dropped segment {}.'.format(oldest))
+
+    def pending(self):
+        """Return the sequence numbers of closed segments, oldest first."""
+        return [seq for seq, _ in self.pending_sizes()]
+
+    def pending_sizes(self):
+        """Return (sequence number, size) of closed segments, oldest
+           first.
+        """
+        with self.lock:
+            return sorted((seq, size) for seq, size in self.sizes.iteritems()
+                          if seq != self.current)
+
+    def pending_bytes(self):
+        """Return the size of all closed segments."""
+        with self.lock:
+            return self.total_bytes - self.sizes.get(self.current, 0)
+
+    def read_segment(self, seq):
+        """Return the readings in a segment as a list of lists.
+
+           A line cut short by a crash or power loss is skipped.
+        """
+        readings = []
+        with open(self.path(seq), 'rb') as stream:
+            for line in stream:
+                try:
+                    readings.append(json.loads(line))
+                except ValueError:
+                    pass
+        return readings
+
+    def batch(self, max_bytes):
+        """Return the oldest closed segments fitting in `max_bytes`.
+
+           At least one segment is returned whenever any are pending. A
+           full outbox may drop segments while a batch is being read; the
+           batch then ends before the first one missing, so it never
+           spans a gap.
+
+           Returns
+           -------
+             (tuple) : list of sequence numbers and the combined list of
+               their readings
+        """
+        seqs, readings, size = [], [], 0
+        for seq, seg_size in self.pending_sizes():
+            if seqs and size + seg_size > max_bytes:
+                break
+            try:
+                segment = self.read_segment(seq)
+            except (IOError, OSError):
+                # dropped since pending_sizes; it's been counted already
+                if seqs:
+                    break
+                continue
+            seqs.append(seq)
+            readings.extend(segment)
+            size += seg_size
+        return seqs, readings
+
+    def ack(self, seqs):
+        """Forget segments which have been uploaded."""
+        with self.lock:
+            for seq in seqs:
+                size = self.sizes.pop(seq, None)
+                if size is not None:
+                    self.total_bytes -= size
+                    os.remove(self.path(seq))
+
+    def close(self):
+        """Close the current segment file without rolling over."""
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+
+
+class OutboxDrainer(object):
+    """Background thread uploading closed outbox segments in batches."""
+
+    def __init__(self, outbox, sink, fname='kubbdbs_seg',
+                 batch_bytes=256 * 1024, interval=1.0, retry_wait=5):
+        """Initialize the OutboxDrainer object.
+
+           Parameters
+           ----------
+             outbox (Outbox) : segments to upload
+             sink (FTPSink) : destination; its `send` must accept a
+               `fname` keyword
+             fname (str) : prefix of uploaded file names
+             batch_bytes (int) : most segment bytes sent per upload
+             interval (float) : least seconds between uploads, which caps
+               the catch-up rate after an outage
+             retry_wait (float) : seconds to wait after a failed upload
+        """
+        self.outbox = outbox
+        self.sink = sink
+        self.fname = fname
+        self.batch_bytes = batch_bytes
+        self.interval = interval
+        self.retry_wait = retry_wait
+        self.running = False
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.batches_sent = 0
+        self.segments_sent = 0
+        self.failures = 0
+        self.last_error = None
+
+    def start(self):
+        """Start the drainer thread and return self."""
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='outbox')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        """Stop the drainer; pending segments stay on disk."""
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def drain_once(self):
+        """Upload one batch of segments.
+
+           Returns
+           -------
+             (int) : number of segments uploaded
+        """
+        seqs, readings = self.outbox.batch(self.batch_bytes)
+        if not seqs:
+            return 0
+        data = json.dumps(readings, separators=(',', ':'))
+        name = '{}_{:08d}-{:08d}'.format(self.fname, seqs[0], seqs[-1])
+        self.sink.send(data, fname=name)
+        self.outbox.ack(seqs)
+        self.batches_sent += 1
+        self.segments_sent += len(seqs)
+        return len(seqs)
+
+    def _run(self):
+        while self.running:
+            wait = self.interval
+            try:
+                self.drain_once()
+            except Exception as e:
+                self.failures += 1
+                self.last_error = '{}: {}'.format(type(e).__name__, e)
+                print('Outbox upload failed: {}'.format(self.last_error))
+                wait = self.retry_wait
+            self.wakeup.wait(wait)
+            self.wakeup.clear()
+
+    def stats(self):
+        """Return the drainer's and outbox's counters as a dict."""
+        return {'batches_sent': self.batches_sent,
+                'segments_sent': self.segments_sent,
+                'failures': self.failures,
+                'last_error': self.last_error,
+                'pending_segments': len(self.outbox.pending()),
+                'pending_bytes': self.outbox.pending_bytes(),
+                'dropped_segments': self.outbox.dropped_segments}
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Small streaming pipeline of sources, processors and sinks.
+
+A `Bus` delivers each (timestamp, dB) reading to every subscriber, in
+subscription order, as the very same tuple object. Subscribers are plain
+callables or generator-based coroutines (see `coroutine`), so a new stage
+is added by subscribing it rather than by editing the loop that reads the
+meter. A subscriber which raises is counted in the bus's `failures` and
+the reading still goes on to the rest, so one broken stage (a full disk
+under the outbox, say) doesn't leave the statistics, live feed and labels
+out of step with each other.
+
+    bus = Bus()
+    stats = bus.subscribe(RunningStats())
+    bus.subscribe(history.append)
+    bus.subscribe(ThresholdDetector(100, 10000, callback=alert))
+    MeterSource(bus, read_db).poll()
+"""
+
+from __future__ import print_function, division
+
+import functools
+import time
+
+
+def coroutine(func):
+    """Decorate a generator function so that it is primed on creation."""
+    @functools.wraps(func)
+    def start(*args, **kwargs):
+        gen = func(*args, **kwargs)
+        next(gen)
+        return gen
+    return start
+
+
+class Bus(object):
+    """Deliver readings to every subscriber."""
+
+    def __init__(self):
+        self.subscribers = []
+        # stage --> (number of failures, last error message)
+        self.failures = {}
+
+    def subscribe(self, stage):
+        """Add a stage to the end of the delivery order and return it.
+
+           Parameters
+           ----------
+             stage (callable, generator) : called with each reading, or
+               a primed coroutine which is sent each reading
+        """
+        target = stage.send if hasattr(stage, 'send') else stage
+        self.subscribers.append((stage, target))
+        return stage
+
+    def unsubscribe(self, stage):
+        """Stop delivering readings to a stage."""
+        self.subscribers = [(s, t) for (s, t) in self.subscribers
+                            if s is not stage]
+
+    def publish(self, reading):
+        """Deliver one reading to every subscriber.
+
+           Parameters
+           ----------
+             reading (tuple) : a Unix timestamp in milliseconds and a
+               decibel reading
+        """
+        for stage, target in self.subscribers:
+            try:
+                target(reading)
+            except Exception as e:
+                self._failed(stage, e)
+        return reading
+
+    def _failed(self, stage, error):
+        """Count a subscriber's failure, printing it unless it repeats."""
+        count, last = self.failures.get(stage, (0, None))
+        message = '{}: {}'.format(type(error).__name__, error)
+        if message != last:
+            name = getattr(stage, '__name__', type(stage).__name__)
+            print('Subscriber {} failed: {}'.format(name, message))
+        self.failures[stage] = (count + 1, message)
+
+
+# sources
+
+class MeterSource(object):
+    """Read the meter on demand and publish timestamped readings."""
+
+    def __init__(self, bus, read_db, clock=time.time):
+        """Initialize the MeterSource object.
+
+           Parameters
+           ----------
+             bus (Bus) : bus on which readings are published
+             read_db (function) : returns the current decibel reading
+             clock (function) : returns the current Unix time in seconds
+        """
+        self.bus = bus
+        self.read_db = read_db
+        self.clock = clock
+
+    def read(self):
+        """Take one reading and return it without publishing it."""
+        # Unix timestamp in milliseconds
+        return int(round(self.clock() * 1000)), self.read_db()
+
+    def poll(self):
+        """Take one reading, publish it and return it."""
+        return self.bus.publish(self.read())
+
+
+class ReplaySource(object):
+    """Publish previously recorded readings, e.g. from a saved game."""
+
+    def __init__(self, bus, readings):
+        """Initialize the ReplaySource object.
+
+           Parameters
+           ----------
+             bus (Bus) : bus on which readings are published
+             readings (iterable) : chronological (timestamp, dB) pairs
+        """
+        self.bus = bus
+        self.readings = iter(readings)
+
+    def poll(self):
+        """Publish the next recorded reading, or return None when done."""
+        reading = next(self.readings, None)
+        if reading is None:
+            return None
+        return self.bus.publish(tuple(reading))
+
+    def run(self, speed=None):
+        """Publish every remaining reading.
+
+           Parameters
+           ----------
+             speed (float) : playback speed relative to real time, or None
+               to publish as fast as possible
+        """
+        previous = None
+        for reading in self.readings:
+            if speed and previous is not None:
+                time.sleep(max(0, reading[0] - previous) / 1000 / speed)
+            previous = reading[0]
+            self.bus.publish(tuple(reading))
+
+
+# processors
+
+class RunningStats(object):
+    """Running count, total and maximum of every reading seen."""
+
+    def __init__(self, minimum=None):
+        """Initialize the RunningStats object.
+
+           Parameters
+           ----------
+             minimum (float) : value reported as the maximum before any
+               reading has been seen
+        """
+        self.seen = 0
+        self.total = 0.0
+        self.maximum = minimum
+        self.current = minimum
+
+    def __call__(self, reading):
+        db = reading[1]
+        self.seen += 1
+        self.total += db
+        self.current = db
+        if self.maximum is None or db > self.maximum:
+            self.maximum = db
+
+    @property
+    def average(self):
+        """Mean of every reading seen, rounded to two decimal places."""
+        if not self.seen:
+            return self.current
+        return float('{0:.2f}'.format(self.total / self.seen))
+
+    def state(self):
+        """Return the counters as a dict, e.g. for a checkpoint."""
+        return {'seen': self.seen, 'total': self.total,
+                'maximum': self.maximum, 'current': self.current}
+
+    def restore(self, state):
+        """Continue from counters returned by `state`."""
+        self.seen = state['seen']
+        self.total = state['total']
+        self.maximum = state['maximum']
+        self.current = state['current']
+
+
+class LevelHistogram(object):
+    """Count of readings in each 1 dB band, for percentiles."""
+
+    def __init__(self, min_db=30, max_db=130):
+        """Initialize the LevelHistogram object.
+
+           Parameters
+           ----------
+             min_db (int) : readings below this count in the lowest band
+             max_db (int) : readings above this count in the highest band
+        """
+        self.min_db = int(min_db)
+        self.counts = [0] * (int(max_db) - self.min_db + 1)
+
+    def __call__(self, reading):
+        band = int(reading[1]) - self.min_db
+        self.counts[max(0, min(len(self.counts) - 1, band))] += 1
+
+    def percentile(self, pct):
+        """Return the band (in dB) below which `pct` percent of readings
+           fall, or None before any reading.
+        """
+        total = sum(self.counts)
+        if not total:
+            return None
+        running = 0
+        for band, count in enumerate(self.counts):
+            running += count
+            if running * 100 >= pct * total:
+                return self.min_db + band
+        return self.min_db + len(self.counts) - 1
+
+    def state(self):
+        """Return the counts as a dict, e.g. for a checkpoint."""
+        return {'min_db': self.min_db, 'counts': list(self.counts)}
+
+    def restore(self, state):
+        """Continue from counts returned by `state`."""
+        if (state['min_db'] == self.min_db and
+                len(state['counts']) == len(self.counts)):
+            self.counts = list(state['counts'])
+
+
+@coroutine
+def smoothing(output, alpha=0.3):
+    """Republish readings smoothed with an exponential moving average.
+
+       Parameters
+       ----------
+         output (Bus) : bus on which smoothed readings are published
+         alpha (float) : weight of the newest reading, between 0 and 1
+    """
+    level = None
+    while True:
+        t, db = (yield)
+        level = db if level is None else level + alpha * (db - level)
+        output.publish((t, round(level, 2)))
+
+
+class ThresholdDetector(object):
+    """Call back when the level stays above a threshold long enough."""
+
+    def __init__(self, threshold, duration_ms, callback):
+        """Initialize the ThresholdDetector object.
+
+           Parameters
+           ----------
+             threshold (float) : decibel level to watch for
+             duration_ms (int) : how long the level must stay at or above
+               the threshold before `callback` is called
+             callback (function) : called once per loud stretch with the
+               reading that completed it
+        """
+        self.threshold = threshold
+        self.duration_ms = duration_ms
+        self.callback = callback
+        self.since = None
+        self.fired = False
+
+    def __call__(self, reading):
+        t, db = reading
+        if db < self.threshold:
+            self.since, self.fired = None, False
+            return
+        if self.since is None:
+            self.since = t
+        if not self.fired and t - self.since >= self.duration_ms:
+            self.fired = True
+            self.callback(reading)
+
+
+# sinks
+
+class QueueSink(object):
+    """Forward readings to a Queue, e.g. to hand them to the GUI thread."""
+
+    def __init__(self, queue):
+        """Initialize the QueueSink object.
+
+           Parameters
+           ----------
+             queue (Queue.Queue) : queue which receives every reading
+        """
+        self.queue = queue
+
+    def __call__(self, reading):
+        self.queue.put(reading)
+
+
+class EveryNth(object):
+    """Call a function with every Nth reading only."""
+
+    def __init__(self, n, func):
+        """Initialize the EveryNth object.
+
+           Parameters
+           ----------
+             n (int) : how many readings pass between calls
+             func (function) : called with the reading
+        """
+        self.n = n
+        self.func = func
+        self.count = 0
+
+    def __call__(self, reading):
+        self.count += 1
+        if self.count % self.n == 0:
+            self.func(reading)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Start and stop a profiler inside the running app.
+
+Two profilers are available:
+
+  'sampling'  a background thread records every thread's call stack a few
+              hundred times per second. It covers the Tk main loop, the
+              meter thread and the publisher threads at once, and costs
+              little enough to leave running during a game.
+  'cprofile'  the standard deterministic profiler. It is much more
+              detailed but slower, and only sees the thread that started
+              it (the Tk main loop when toggled from the keyboard).
+
+Results are written to a timestamped file in the working directory when
+the profiler is stopped. Toggle with F9 in the Tk window (`bind_tk`) or,
+without a window, with SIGUSR1 (Ctrl+Break on Windows; `install_signal`).
+"""
+
+from __future__ import print_function, division
+
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+
+
+class SamplingProfiler(object):
+    """Statistical profiler which samples the stacks of all threads."""
+
+    def __init__(self, interval=0.005):
+        """Initialize the SamplingProfiler object.
+
+           Parameters
+           ----------
+             interval (float) : seconds between samples
+        """
+        self.interval = interval
+        self.samples = 0
+        # (thread name, function) --> samples with function on top
+        self.own = collections.Counter()
+        # (thread name, function) --> samples with function anywhere
+        self.total = collections.Counter()
+        self.running = False
+        self.thread = None
+        self.started = None
+        self.stopped = None
+
+    def start(self):
+        """Start sampling in a background thread."""
+        self.running = True
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run, name='profiler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sampler to finish."""
+        self.running = False
+        self.thread.join()
+        self.stopped = time.time()
+
+    def _run(self):
+        me = threading.current_thread().ident
+        while self.running:
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                self._sample(names.get(ident, str(ident)), frame)
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def _sample(self, thread_name, frame):
+        seen = set()
+        top = True
+        while frame is not None:
+            code = frame.f_code
+            key = (thread_name, '{}:{}({})'.format(
+                os.path.basename(code.co_filename), code.co_firstlineno,
+                code.co_name))
+            if top:
+                self.own[key] += 1
+                top = False
+            # count recursive functions once per sample
+            if key not in seen:
+                seen.add(key)
+                self.total[key] += 1
+            frame = frame.f_back
+
+    def dump(self, path, limit=40):
+        """Write the busiest functions of each thread to a text file.
+
+           Parameters
+           ----------
+             path (str) : output file
+             limit (int) : most functions listed per thread
+        """
+        threads = sorted(set(name for name, _ in self.total))
+        with open(path, 'w') as stream:
+            stream.write('{} samples every {:.1f} ms over {:.1f} s\n'.format(
+                self.samples, self.interval * 1000,
+                (self.stopped or time.time()) - self.started))
+            for thread_name in threads:
+                rows = sorted(((n, key[1]) for key, n in
+                               self.total.iteritems()
+                               if key[0] == thread_name), reverse=True)
+                stream.write('\nThread {}\n'.format(thread_name))
+                stream.write('{:>8} {:>8}  function\n'.format('total',
+                                                              'own'))
+                for n, func in rows[:limit]:
+                    stream.write('{:>8} {:>8}  {}\n'.format(
+                        n, self.own[(thread_name, func)], func))
+
+
+class CProfiler(object):
+    """cProfile wrapped with the same interface as SamplingProfiler."""
+
+    def __init__(self):
+        # only loaded when asked for, not with every launch of the app
+        import cProfile
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        """Start profiling the calling thread."""
+        self.profile.enable()
+
+    def stop(self):
+        """Stop profiling."""
+        self.profile.disable()
+
+    def dump(self, path, limit=40):
+        """Write raw stats to `path` and a readable summary next to it."""
+        import pstats
+        self.profile.dump_stats(path)
+        with open(os.path.splitext(path)[0] + '.txt', 'w') as stream:
+            stats = pstats.Stats(self.profile, stream=stream)
+            stats.sort_stats('cumulative').print_stats(limit)
+
+
+class ProfilerToggle(object):
+    """Turn profiling on and off, saving results each time it stops."""
+
+    def __init__(self, mode='sampling', directory='.', **kwargs):
+        """Initialize the ProfilerToggle object.
+
+           Parameters
+           ----------
+             mode (str) : 'sampling' or 'cprofile'
+             directory (str) : where result files are written
+             **kwargs : passed on to the profiler
+        """
+        if mode not in ('sampling', 'cprofile'):
+            raise ValueError('Unknown profiler: {}'.format(mode))
+        self.mode = mode
+        self.directory = directory
+        self.kwargs = kwargs
+        self.profiler = None
+
+    @property
+    def active(self):
+        """True while a profiler is running."""
+        return self.profiler is not None
+
+    def start(self):
+        """Start a new profiler if none is running."""
+        if self.profiler is not None:
+            return
+        if self.mode == 'sampling':
+            self.profiler = SamplingProfiler(**self.kwargs)
+        else:
+            self.profiler = CProfiler(**self.kwargs)
+        self.profiler.start()
+        print('Profiling started ({}).'.format(self.mode))
+
+    def stop(self):
+        """Stop the running profiler and return the results file."""
+        if self.profiler is None:
+            return None
+        profiler, self.profiler = self.profiler, None
+        profiler.stop()
+        ext = '.txt' if self.mode == 'sampling' else '.prof'
+        path = os.path.join(self.directory, 'profile_{}{}'.format(
+            time.strftime('%Y%m%d_%H%M%S'), ext))
+        profiler.dump(path)
+        print('Profiling stopped; results saved to {}'.format(path))
+        return path
+
+    def toggle(self, *args):
+        """Start profiling if stopped, or stop it if running.
+
+           Accepts and ignores any arguments, so it can be used directly
+           as a Tk event or signal handler.
+        """
+        if self.active:
+            return self.stop()
+        self.start()
+
+
+def bind_tk(widget, toggle, sequence='<F9>'):
+    """Toggle profiling with a key press anywhere in a Tk application.
+
+       Parameters
+       ----------
+         widget (Tkinter widget) : any widget of the application
+         toggle (ProfilerToggle) : profiler to start and stop
+         sequence (str) : Tk event sequence
+    """
+    widget.bind_all(sequence, toggle.toggle)
+
+
+def install_signal(toggle):
+    """Toggle profiling with SIGUSR1, or Ctrl+Break on Windows.
+
+       Returns
+       -------
+         (bool) : False if the platform has neither signal
+    """
+    signum = getattr(signal, 'SIGUSR1', getattr(signal, 'SIGBREAK', None))
+    if signum is None:
+        return False
+    signal.signal(signum, toggle.toggle)
+    return True
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Publish decibel readings to several destinations at once.
+
+Every sink (an FTP server, a local directory, ...) is driven by its own
+worker thread with a small bounded queue, so a slow or unreachable sink
+never holds up the others or the display. When a sink falls behind, its
+queue's policy decides what happens to the backlog:
+
+  'coalesce'     keep only the newest payload (each payload is a complete
+                 window of recent readings, so older ones are redundant)
+  'drop_oldest'  discard the oldest queued payload to make room
+  'drop_newest'  discard the incoming payload
+"""
+
+from __future__ import print_function, division
+
+import backends
+import collections
+import json
+import os
+import threading
+import time
+
+try:
+    import cStringIO as StringIO
+except ImportError:
+    import StringIO
+
+ftplib = backends.lazy('ftp')
+
+POLICIES = ('coalesce', 'drop_oldest', 'drop_newest')
+# longest wait in seconds between retries, however long an outage lasts
+MAX_RETRY_WAIT = 30
+
+
+def fibonacci_number(n):
+    """Return the Nth Fibonacci number."""
+    a, b = 1, 1
+    for _ in xrange(n - 1):
+        a, b = b, a + b
+    return a
+
+
+class FTPSink(object):
+    """Upload payloads to a directory on an FTP server."""
+
+    def __init__(self, host, user, password, directory, fname='kubbdbs',
+                 name=None, timeout=30, port=21):
+        """Initialize the FTPSink object.
+
+           Parameters
+           ----------
+             host (str) : FTP hostname
+             user (str) : FTP username
+             password (str) : FTP password
+             directory (str) : desired FTP subdirectory
+             fname (str) : remote file name, minus extension
+             name (str) : label used in statistics; defaults to the host
+             timeout (int) : socket timeout in seconds
+             port (int) : FTP control port
+        """
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.directory = directory
+        self.fname = fname
+        self.name = name or host
+        self.timeout = timeout
+
+    def send(self, data, fname=None):
+        """Upload a JSON string and return the server's final reply.
+
+           Parameters
+           ----------
+             data (str) : JSON to upload
+             fname (str) : remote file name, minus extension; defaults
+               to the sink's `fname`
+        """
+        if fname is None:
+            fname = self.fname
+        ftp = ftplib.FTP(timeout=self.timeout)
+        try:
+            ftp.connect(self.host, self.port)
+            ftp.login(self.user, self.password)
+            if self.directory:
+                ftp.cwd(self.directory)
+            return ftp.storbinary('STOR {}.json'.format(fname),
+                                  StringIO.StringIO(data))
+        finally:
+            try:
+                ftp.quit()
+            except Exception:
+                ftp.close()
+
+
+class DirectorySink(object):
+    """Write payloads to a file in a local directory."""
+
+    def __init__(self, directory, fname='kubbdbs', name=None):
+        """Initialize the DirectorySink object.
+
+           Parameters
+           ----------
+             directory (str) : destination directory, e.g. a network share
+             fname (str) : file name, minus extension
+             name (str) : label used in statistics; defaults to the path
+        """
+        self.directory = directory
+        self.fname = fname
+        self.name = name or directory
+
+    def send(self, data, fname=None):
+        """Replace the destination file with a JSON string.
+
+           Parameters
+           ----------
+             data (str) : JSON to write
+             fname (str) : file name, minus extension; defaults to the
+               sink's `fname`
+        """
+        if fname is None:
+            fname = self.fname
+        path = os.path.join(self.directory, fname + '.json')
+        temp = path + '.tmp'
+        with open(temp, 'wb') as stream:
+            stream.write(data)
+        # Windows won't rename over an existing file
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(temp, path)
+
+
+class SinkWorker(object):
+    """Background thread feeding one sink from a bounded queue."""
+
+    def __init__(self, sink, maxsize=4, policy='coalesce', retry_wait=1,
+                 max_wait=MAX_RETRY_WAIT):
+        """Initialize the SinkWorker object.
+
+           Parameters
+           ----------
+             sink (object) : anything with a `send(data)` method and a
+               `name` attribute
+             maxsize (int) : most payloads allowed to wait for this sink
+             policy (str) : what to do when the queue is full; one of
+               'coalesce', 'drop_oldest' or 'drop_newest'
+             retry_wait (int) : base wait in seconds after a failed
+               send; successive failures add a Fibonacci backoff
+             max_wait (float) : longest wait between retries, so that a
+               sink which comes back after a long outage is retried soon
+        """
+        if policy not in POLICIES:
+            raise ValueError('Unknown queue policy: {}'.format(policy))
+        self.sink = sink
+        self.name = sink.name
+        self.maxsize = 1 if policy == 'coalesce' else maxsize
+        self.policy = policy
+        self.retry_wait = retry_wait
+        self.max_wait = max_wait
+        self.pending = collections.deque()
+        self.cond = threading.Condition()
+        self.running = False
+        self.thread = None
+        # statistics
+        self.started = None
+        self.offered = 0
+        self.sent = 0
+        self.dropped = 0
+        self.failures = 0
+        self.bytes_sent = 0
+        self.last_lag = None
+        self.last_duration = None
+        self.last_success = None
+        self.last_error = None
+        self.fibcounter = 1
+        # called with (ok, duration, lag, size) after every send
+        self.observers = []
+
+    def observe(self, callback):
+        """Have `callback(ok, duration, lag, size)` called after each send.
+
+           It runs on the worker thread, so it must be quick and
+           thread-safe; the lag is None for a failed send.
+        """
+        self.observers.append(callback)
+        return callback
+
+    def _notify(self, ok, duration, lag, size):
+        for callback in self.observers:
+            callback(ok, duration, lag, size)
+
+    def start(self):
+        """Start the worker thread."""
+        self.running = True
+        self.started = time.time()
+        self.thread = threading.Thread(target=self._run,
+                                       name='sink-{}'.format(self.name))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        """Ask the worker thread to finish and wait for it."""
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def offer(self, data):
+        """Queue a payload for sending without ever blocking the caller.
+
+           Parameters
+           ----------
+             data (str) : serialized payload
+        """
+        item = (time.time(), data)
+        with self.cond:
+            self.offered += 1
+            if len(self.pending) >= self.maxsize:
+                self.dropped += 1
+                if self.policy == 'drop_newest':
+                    return
+                self.pending.popleft()
+            self.pending.append(item)
+            self.cond.notify()
+
+    def _requeue(self, item):
+        """Put a payload whose send failed back at the head of the queue,
+           applying the drop policy if the queue has filled meanwhile.
+           The caller holds `cond`.
+        """
+        if len(self.pending) >= self.maxsize:
+            # whichever payload the policy gives up counts as dropped
+            self.dropped += 1
+            if self.policy != 'drop_newest':
+                # it's the oldest, or superseded by a newer one
+                return
+            self.pending.pop()
+        self.pending.appendleft(item)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.pending:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                queued_at, data = self.pending.popleft()
+            began = time.time()
+            try:
+                self.sink.send(data)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = '{}: {}'.format(type(e).__name__, e)
+                print('Sink {} failed: {}'.format(self.name, self.last_error))
+                self._notify(False, time.time() - began, None, len(data))
+                with self.cond:
+                    self._requeue((queued_at, data))
+                    wait = min(self.max_wait, self.retry_wait +
+                               fibonacci_number(self.fibcounter))
+                    if wait < self.max_wait:
+                        self.fibcounter += 1
+                    # new payloads don't cut the backoff short; stop() does
+                    deadline = time.time() + wait
+                    while self.running and time.time() < deadline:
+                        self.cond.wait(deadline - time.time())
+                continue
+            now = time.time()
+            self.sent += 1
+            self.bytes_sent += len(data)
+            self.last_duration = now - began
+            self.last_lag = now - queued_at
+            self.last_success = now
+            self.fibcounter = 1
+            self._notify(True, self.last_duration, self.last_lag, len(data))
+
+    def stats(self):
+        """Return a snapshot of this sink's counters.
+
+           Returns
+           -------
+             (dict) : payloads offered, sent, dropped and failed; bytes
+               sent and average throughput in bytes per second; duration
+               of the last send and lag from queueing to delivery of the
+               last payload, in seconds; queue depth and last error
+        """
+        elapsed = time.time() - self.started if self.started else 0
+        return {
+            'name': self.name,
+            'policy': self.policy,
+            'offered': self.offered,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'failures': self.failures,
+            'pending': len(self.pending),
+            'bytes_sent': self.bytes_sent,
+            'bytes_per_sec': self.bytes_sent / elapsed if elapsed else 0.0,
+            'last_duration': self.last_duration,
+            'last_lag': self.last_lag,
+            'since_success': (None if self.last_success is None
+                              else time.time() - self.last_success),
+            'last_error': self.last_error,
+        }
+
+
+class PublisherFanout(object):
+    """Hand each payload to every sink's worker."""
+
+    def __init__(self, workers=None):
+        """Initialize the PublisherFanout object.
+
+           Parameters
+           ----------
+             workers (list) : SinkWorker objects
+        """
+        self.workers = list(workers or [])
+
+    def add_sink(self, sink, **kwargs):
+        """Wrap a sink in a SinkWorker and add it to the fan-out."""
+        worker = SinkWorker(sink, **kwargs)
+        self.workers.append(worker)
+        return worker
+
+    def observe(self, callback, name=None):
+        """Observe the sends of the sink called `name`, or of every sink.
+
+           See `SinkWorker.observe`.
+        """
+        for worker in self.workers:
+            if name is None or worker.name == name:
+                worker.observe(callback)
+        return callback
+
+    def start(self):
+        """Start every sink's worker thread."""
+        for worker in self.workers:
+            worker.start()
+        return self
+
+    def stop(self, timeout=5):
+        """Stop every sink's worker thread."""
+        for worker in self.workers:
+            worker.stop(timeout)
+
+    def publish(self, obj):
+        """Serialize an object once and queue it for every sink.
+
+           Parameters
+           ----------
+             obj (list, str) : readings, typically a list of 2-tuples, or
+               a string of already serialized JSON
+        """
+        if isinstance(obj, basestring):
+            data = obj
+        else:
+            obj = [obj] if isinstance(obj, tuple) else obj
+            data = json.dumps(obj, indent=None, separators=(',', ':'))
+        for worker in self.workers:
+            worker.offer(data)
+
+    def stats(self):
+        """Return a list of per-sink statistics dicts."""
+        return [worker.stats() for worker in self.workers]
+
+    def format_stats(self):
+        """Return per-sink statistics as human-readable lines."""
+        lines = []
+        for s in self.stats():
+            lag = '-' if s['last_lag'] is None else '{:.2f}s'.format(
+                s['last_lag'])
+            lines.append('{name}: sent {sent}, dropped {dropped}, failed '
+                         '{failures}, pending {pending}, {rate:.0f} B/s, '
+                         'lag {lag}'.format(rate=s['bytes_per_sec'], lag=lag,
+                                            **s))
+        return '\n'.join(lines)
+
+
+def ftp_sink_from_config(config, prefix='FTP_', name='primary',
+                         fname='kubbdbs'):
+    """Return an FTPSink for one server in `ftpconfig`, or None.
+
+       Parameters
+       ----------
+         config (module) : the imported `ftpconfig` module
+         prefix (str) : 'FTP_' for the primary server or 'FTP_BACKUP_'
+         name (str) : label used in statistics
+         fname (str) : published file name, minus extension
+    """
+    host = getattr(config, prefix + 'HOST', None)
+    if not host:
+        return None
+    return FTPSink(host, getattr(config, prefix + 'USERNAME', ''),
+                   getattr(config, prefix + 'PASSWORD', ''),
+                   getattr(config, prefix + 'DIR', ''), fname=fname,
+                   name=name, port=getattr(config, prefix + 'PORT', 21))
+
+
+def publisher_from_config(config, fname='kubbdbs'):
+    """Build a fan-out from the settings in an `ftpconfig` module.
+
+       Recognized settings are FTP_HOST, FTP_USERNAME, FTP_PASSWORD,
+       FTP_DIR and FTP_PORT for the primary server, the same names with
+       a FTP_BACKUP_ prefix for a backup server, and PUBLISH_DIR for a
+       local directory. Missing settings are skipped.
+
+       Parameters
+       ----------
+         config (module) : the imported `ftpconfig` module
+         fname (str) : published file name, minus extension
+    """
+    fanout = PublisherFanout()
+    for prefix, name in (('FTP_', 'primary'), ('FTP_BACKUP_', 'backup')):
+        sink = ftp_sink_from_config(config, prefix, name, fname)
+        if sink is not None:
+            fanout.add_sink(sink)
+    directory = getattr(config, 'PUBLISH_DIR', None)
+    if directory:
+        fanout.add_sink(DirectorySink(directory, fname=fname, name='local'))
+    return fanout
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Adapt the upload cadence and payload size to the link.
+
+UploadRateController watches the outcome of every upload to one sink,
+the same way TCP watches acknowledgements. A failed upload, or one whose
+round trip takes more than `congestion_ratio` of the upload interval,
+counts as congestion: the interval is multiplied and the payload window
+divided by `backoff`. Every upload which comes back comfortably within the
+interval shortens the interval and widens the window by a fixed step, so
+the rate recovers gradually once the link clears. Both stay within the
+configured bounds, and the window never becomes shorter than the
+interval, so consecutive payloads still overlap. (Readings for the
+permanent record go through the outbox, which doesn't depend on this.)
+"""
+
+from __future__ import print_function, division
+
+import collections
+import threading
+import time
+
+
+class UploadRateController(object):
+    """Additive-increase, multiplicative-decrease upload rate control."""
+
+    def __init__(self, min_interval=1.0, max_interval=30.0, min_window=5,
+                 max_window=300, interval_step=0.5, window_step=10,
+                 backoff=2.0, congestion_ratio=0.5, smoothing=0.125,
+                 history=100, window=20):
+        """Initialize the UploadRateController object.
+
+           Parameters
+           ----------
+             min_interval (float) : shortest seconds between uploads
+             max_interval (float) : longest seconds between uploads
+             min_window (int) : fewest seconds of readings per payload
+             max_window (int) : most seconds of readings per payload
+             interval_step (float) : seconds taken off the interval after
+               each uncongested upload
+             window_step (int) : seconds added to the window after each
+               uncongested upload
+             backoff (float) : factor applied to both on congestion
+             congestion_ratio (float) : round trip, as a fraction of the
+               interval, above which an upload counts as congested
+             smoothing (float) : weight of the newest sample in the
+               smoothed round trip time and failure rate
+             history (int) : number of recent decisions kept
+             window (int) : seconds of readings in the first payloads
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.min_window = min_window
+        self.max_window = max_window
+        self.interval_step = interval_step
+        self.window_step = window_step
+        self.backoff = backoff
+        self.congestion_ratio = congestion_ratio
+        self.smoothing = smoothing
+        self.lock = threading.Lock()
+        self.interval = min_interval
+        self.window = max(min_window, min(max_window, window))
+        self.srtt = None
+        self.failure_rate = 0.0
+        self.uploads = 0
+        self.failures = 0
+        self.congestions = 0
+        self.last_lag = None
+        self.decisions = collections.deque(maxlen=history)
+
+    def __call__(self, ok, duration, lag=None, size=None):
+        """Record the outcome of one upload, so a controller can observe a
+           SinkWorker.
+
+           Parameters
+           ----------
+             ok (boolean) : did the upload succeed?
+             duration (float) : seconds the upload took, successful or not
+             lag (float) : seconds from queueing to delivery, if delivered
+             size (int) : bytes in the payload
+        """
+        self.record(ok, duration, lag)
+
+    def record(self, ok, duration, lag=None):
+        """Update the measurements and adjust the interval and window."""
+        a = self.smoothing
+        with self.lock:
+            self.uploads += 1
+            self.failure_rate += a * ((0.0 if ok else 1.0) -
+                                      self.failure_rate)
+            if not ok:
+                self.failures += 1
+                self._back_off('failure')
+                return
+            self.srtt = (duration if self.srtt is None else
+                         self.srtt + a * (duration - self.srtt))
+            self.last_lag = lag
+            if duration > self.congestion_ratio * self.interval:
+                self._back_off('slow')
+            else:
+                self._recover(duration)
+
+    def _back_off(self, reason):
+        self.congestions += 1
+        self._set(self.interval * self.backoff, self.window / self.backoff,
+                  reason)
+
+    def _recover(self, duration):
+        # the round trip also bounds how short the interval can usefully
+        # be; going below it would only queue uploads behind each other
+        floor = duration / self.congestion_ratio
+        interval = max(self.interval - self.interval_step, floor)
+        self._set(interval, self.window + self.window_step, 'ok')
+
+    def _set(self, interval, window, reason):
+        interval = max(self.min_interval, min(self.max_interval, interval))
+        window = max(self.min_window, min(self.max_window, window))
+        # payloads must span the gap between them
+        window = max(window, min(self.max_window, interval))
+        if interval != self.interval or window != self.window:
+            self.interval, self.window = interval, window
+            self.decisions.append((time.time(), reason, interval, window))
+
+    def current(self):
+        """Return the (interval, window) to use for the next upload."""
+        with self.lock:
+            return self.interval, self.window
+
+    def stats(self):
+        """Return the measurements and current decision as a dict."""
+        with self.lock:
+            return {'interval': self.interval,
+                    'window': self.window,
+                    'srtt': self.srtt,
+                    'failure_rate': self.failure_rate,
+                    'uploads': self.uploads,
+                    'failures': self.failures,
+                    'congestions': self.congestions,
+                    'last_lag': self.last_lag,
+                    'decisions': list(self.decisions)}
+
+    def format_stats(self):
+        """Return the current decision as a human-readable line."""
+        s = self.stats()
+        s['rtt'] = '-' if s['srtt'] is None else '{:.2f}s'.format(s['srtt'])
+        return ('upload every {interval:.1f}s, {window:.0f}s window; rtt '
+                '{rtt}, failure rate {failure_rate:.0%}, {congestions} '
+                'back-offs in {uploads} uploads').format(**s)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Deadline-based scheduling of periodic work on a monotonic clock.
+
+Each task's deadlines are fixed multiples of its period from when it was
+added, so time spent doing the work never pushes later runs back. When
+work overruns and deadlines are missed, those runs are skipped rather
+than queued up and run back to back, and the skips are counted. A task
+which raises is counted too, and the other tasks (and its own later
+runs) carry on.
+"""
+
+from __future__ import print_function, division
+
+import math
+import os
+import sys
+import time
+
+
+def _monotonic_clock():
+    """Return the best available monotonic clock function."""
+    if hasattr(time, 'monotonic'):
+        return time.monotonic
+    if sys.platform == 'win32':
+        # on Windows, time.clock() reads QueryPerformanceCounter
+        return time.clock
+    try:
+        import ctypes
+        import ctypes.util
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long),
+                        ('tv_nsec', ctypes.c_long)]
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or
+                            ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        # CLOCK_MONOTONIC is 1 on Linux and 6 on macOS
+        clock_id = 6 if sys.platform == 'darwin' else 1
+
+        def monotonic():
+            # the GIL is released during the call, so a timespec shared
+            # between threads could mix the fields of two readings
+            ts = timespec()
+            if clock_gettime(clock_id, ctypes.byref(ts)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        monotonic()
+        return monotonic
+    except (AttributeError, ImportError, OSError, TypeError):
+        return time.time
+
+monotonic = _monotonic_clock()
+
+
+class Task(object):
+    """A function run once per period, with timing statistics."""
+
+    def __init__(self, name, period, func, first_due):
+        """Initialize the Task object.
+
+           Parameters
+           ----------
+             name (str) : label used in reports
+             period (float) : seconds between deadlines
+             func (function) : called with no arguments at each deadline
+             first_due (float) : clock time of the first deadline
+        """
+        self.name = name
+        self.period = period
+        self.func = func
+        self.due = first_due
+        self.runs = 0
+        self.skipped = 0
+        self.overruns = 0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.max_lateness = 0.0
+        self.errors = 0
+        self.last_error = None
+
+    def stats(self):
+        """Return this task's counters as a dict."""
+        return {'name': self.name, 'period': self.period, 'runs': self.runs,
+                'skipped': self.skipped, 'overruns': self.overruns,
+                'last_duration': self.last_duration,
+                'max_duration': self.max_duration,
+                'max_lateness': self.max_lateness, 'errors': self.errors,
+                'last_error': self.last_error}
+
+
+class DeadlineScheduler(object):
+    """Run several periodic tasks against a shared monotonic clock."""
+
+    def __init__(self, clock=None, on_overrun=None, on_error=None):
+        """Initialize the DeadlineScheduler object.
+
+           Parameters
+           ----------
+             clock (function) : returns the current time in seconds;
+               defaults to `monotonic`
+             on_overrun (function) : called with a Task whenever one of
+               its runs takes longer than its period
+             on_error (function) : called with a Task and the exception
+               whenever one of its runs raises; by default the error is
+               printed, unless it's the same as the task's last one
+        """
+        self.clock = clock or monotonic
+        self.on_overrun = on_overrun
+        self.on_error = on_error
+        self.tasks = []
+        self.stopped = False
+
+    def every(self, period, func, name=None, delay=0):
+        """Run a function once per period and return its Task.
+
+           Parameters
+           ----------
+             period (float) : seconds between runs
+             func (function) : called with no arguments
+             name (str) : label used in reports; defaults to the
+               function's name
+             delay (float) : seconds until the first run
+        """
+        task = Task(name or getattr(func, '__name__', 'task'), period, func,
+                    self.clock() + delay)
+        self.tasks.append(task)
+        return task
+
+    def cancel(self, task):
+        """Stop running a task."""
+        self.tasks = [t for t in self.tasks if t is not task]
+
+    def run_due(self):
+        """Run every task whose deadline has passed.
+
+           Returns
+           -------
+             (int) : number of tasks run
+        """
+        ran = 0
+        for task in list(self.tasks):
+            now = self.clock()
+            if now < task.due:
+                continue
+            task.max_lateness = max(task.max_lateness, now - task.due)
+            try:
+                task.func()
+            except Exception as e:
+                self._failed(task, e)
+            finished = self.clock()
+            task.runs += 1
+            ran += 1
+            task.last_duration = finished - now
+            task.max_duration = max(task.max_duration, task.last_duration)
+            if task.last_duration > task.period:
+                task.overruns += 1
+                if self.on_overrun is not None:
+                    self.on_overrun(task)
+            task.due += task.period
+            if task.due <= finished:
+                # skip the deadlines we've already missed
+                missed = int(math.floor((finished - task.due) /
+                                        task.period)) + 1
+                task.skipped += missed
+                task.due += missed * task.period
+        return ran
+
+    def _failed(self, task, error):
+        """Count a task's failure and report it."""
+        message = '{}: {}'.format(type(error).__name__, error)
+        task.errors += 1
+        if self.on_error is not None:
+            self.on_error(task, error)
+        elif message != task.last_error:
+            print('Task {} failed: {}'.format(task.name, message))
+        task.last_error = message
+
+    def time_until_next(self):
+        """Return seconds until the earliest deadline, or None."""
+        if not self.tasks:
+            return None
+        return max(0.0, min(t.due for t in self.tasks) - self.clock())
+
+    def run(self, running, sleep=time.sleep):
+        """Run tasks on the calling thread while `running()` is true.
+
+           Parameters
+           ----------
+             running (function) : returns False when it's time to stop
+             sleep (function) : waits for a number of seconds
+        """
+        self.stopped = False
+        while running() and not self.stopped:
+            self.run_due()
+            wait = self.time_until_next()
+            if wait is None:
+                return
+            # wake up at least every half second to notice a stop request
+            sleep(min(wait, 0.5))
+
+    def stop(self):
+        """Make `run` return at its next wakeup."""
+        self.stopped = True
+
+    def stats(self):
+        """Return a list of per-task statistics dicts."""
+        return [task.stats() for task in self.tasks]
+
+    def report(self):
+        """Return per-task statistics as human-readable lines."""
+        return '\n'.join(
+            '{name}: {runs} runs, {skipped} skipped, {overruns} overruns, '
+            '{errors} errors, max {max:.1f} ms, max late {late:.1f} ms'.format(
+                max=s['max_duration'] * 1000, late=s['max_lateness'] * 1000,
+                **s)
+            for s in self.stats())
+
+
+class TkScheduler(DeadlineScheduler):
+    """DeadlineScheduler driven by a Tkinter widget's `after` timer."""
+
+    def __init__(self, widget, **kwargs):
+        """Initialize the TkScheduler object.
+
+           Parameters
+           ----------
+             widget (Tkinter widget) : any widget of the running app
+             **kwargs : passed on to DeadlineScheduler
+        """
+        super(TkScheduler, self).__init__(**kwargs)
+        self.widget = widget
+        self.after_id = None
+
+    def start(self):
+        """Start running tasks from the Tk main loop."""
+        self.stop()
+        self.stopped = False
+        self._tick()
+
+    def stop(self):
+        """Stop running tasks; they can be restarted with `start`."""
+        super(TkScheduler, self).stop()
+        if self.after_id is not None:
+            self.widget.after_cancel(self.after_id)
+            self.after_id = None
+
+    def _tick(self):
+        self.after_id = None
+        try:
+            self.run_due()
+        finally:
+            # whatever happened, keep the chain of timers going
+            wait = self.time_until_next()
+            if wait is not None and not self.stopped:
+                # Tk timers have whole-millisecond resolution; round up
+                # so we never wake before the deadline
+                self.after_id = self.widget.after(
+                    max(1, int(math.ceil(wait * 1000))), self._tick)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Write and stream session archives without holding them in memory.
+
+A session archive is a JSON array of [timestamp, dB] pairs, or of the
+run-length entries described in `compaction`, either pretty-printed with
+`indent=3` (as `save_json` writes the end-of-game archive) or compact.
+`iter_readings` yields the (timestamp, dB) readings from either layout
+while reading a small chunk at a time, so a long game never has to be
+materialized as a list of lists.
+
+`write_session` can also write a sidecar index, `<archive>.idx`, holding
+the byte offset of every `INDEX_EVERY`-th entry and its timestamp.
+`read_between` uses it to jump straight to a time range. Without an index
+(or with one left over from a different version of the archive), it
+bisects on byte offsets instead, which still only parses a few entries
+per step rather than the whole prefix.
+"""
+
+from __future__ import print_function, division
+
+import bisect
+import json
+import os
+import re
+
+CHUNK_BYTES = 64 * 1024
+INDEX_EVERY = 256
+# the array of one entry: numbers only, so it can't contain brackets
+ENTRY_RE = re.compile(r'\[([^\[\]]*)\]')
+
+
+def index_path(path):
+    """Return the file name of an archive's sidecar index."""
+    return path + '.idx'
+
+
+def format_entry(entry, indent=None):
+    """Return the JSON text of one entry, as `json.dumps` would lay it out
+       inside the archive's outer array.
+    """
+    values = [json.dumps(value) for value in entry]
+    if indent is None:
+        return '[' + ','.join(values) + ']'
+    pad = ' ' * indent
+    return (pad + '[\n' + ',\n'.join(pad * 2 + v for v in values) + '\n' +
+            pad + ']')
+
+
+def write_session(path, entries, indent=3, index=True):
+    """Write entries as a JSON array, optionally with a sidecar index.
+
+       The output matches `json.dumps(entries, indent=indent,
+       separators=(',', ':'))`, but is written one entry at a time.
+
+       Parameters
+       ----------
+         path (str) : file to write
+         entries (iterable) : [t, db] pairs or run-length entries
+         indent (int) : spaces per level, or None for compact output
+         index (boolean) : write `<path>.idx` as well?
+    """
+    offsets = []
+    count, offset = 0, 1
+    # binary, so that Windows doesn't turn '\n' into '\r\n' and move
+    # every entry past the offset recorded for it
+    with open(path, 'wb') as stream:
+        stream.write('[')
+        for entry in entries:
+            if indent is None:
+                prefix = ',' if count else ''
+            else:
+                prefix = ',\n' if count else '\n'
+            text = prefix + format_entry(entry, indent)
+            if count % INDEX_EVERY == 0:
+                # offset of the entry's opening bracket
+                offsets.append((entry[0], offset + len(prefix)))
+            stream.write(text)
+            offset += len(text)
+            count += 1
+        stream.write('\n]' if indent is not None and count else ']')
+    if index:
+        write_index(path, offsets)
+    elif os.path.exists(index_path(path)):
+        os.remove(index_path(path))
+
+
+def write_index(path, offsets):
+    """Write the sidecar index for an archive which has been written.
+
+       Parameters
+       ----------
+         path (str) : the archive
+         offsets (list) : (timestamp, byte offset) of every
+           `INDEX_EVERY`-th entry
+    """
+    with open(index_path(path), 'w') as stream:
+        json.dump({'size': os.path.getsize(path), 'every': INDEX_EVERY,
+                   'offsets': offsets}, stream, separators=(',', ':'))
+
+
+def read_index(path):
+    """Return an archive's (timestamp, byte offset) index, or None.
+
+       An index whose recorded size doesn't match the archive is ignored.
+    """
+    try:
+        with open(index_path(path), 'r') as stream:
+            index = json.load(stream)
+    except (IOError, ValueError):
+        return None
+    if index.get('size') != os.path.getsize(path):
+        return None
+    return [tuple(pair) for pair in index['offsets']]
+
+
+def parse_entry(text):
+    """Return the numbers between an entry's brackets as a list."""
+    values = text.split(',')
+    entry = [int(values[0]) if values[0].strip().isdigit()
+             else float(values[0]), float(values[1])]
+    entry.extend(int(gap) for gap in values[2:])
+    return entry
+
+
+def iter_entries(stream, offset=0):
+    """Yield (byte offset, entry) for every entry from `offset` on.
+
+       Parameters
+       ----------
+         stream (file) : the archive, opened for reading
+         offset (int) : where to start; need not be an entry boundary,
+           any partial entry there is skipped
+    """
+    stream.seek(offset)
+    buf, base = '', offset
+    while True:
+        chunk = stream.read(CHUNK_BYTES)
+        if not chunk:
+            return
+        buf += chunk
+        end = 0
+        for match in ENTRY_RE.finditer(buf):
+            end = match.end()
+            if match.group(1).strip():
+                yield base + match.start(), parse_entry(match.group(1))
+        # keep whatever follows the last complete entry for next time
+        tail = buf.rfind('[')
+        keep = max(end, tail if tail >= end else len(buf))
+        base += keep
+        buf = buf[keep:]
+
+
+def iter_readings(path, start=0, end=None):
+    """Yield every (timestamp, dB) reading in an archive, in order.
+
+       Parameters
+       ----------
+         path (str) : a pretty-printed or compact archive, plain or
+           run-length encoded
+         start (int) : byte offset to begin at, e.g. one from the index
+         end (int) : byte offset of the first entry not to read, e.g.
+           the next one from the index; None reads to the end
+    """
+    # only reading needs it; the app itself only writes archives
+    from compaction import expand
+    with open(path, 'rb') as stream:
+        for offset, entry in iter_entries(stream, start):
+            if end is not None and offset >= end:
+                return
+            for reading in expand([entry]):
+                yield reading
+
+
+def _first_entry_at(stream, offset):
+    """Return (offset, entry) of the first entry at or after `offset`."""
+    for found in iter_entries(stream, offset):
+        return found
+    return None
+
+
+def _seek_offset(stream, path, start_ms):
+    """Return a byte offset at or before the entry holding `start_ms`."""
+    index = read_index(path)
+    if index:
+        i = bisect.bisect_right([t for t, _ in index], start_ms) - 1
+        return index[i][1] if i >= 0 else 0
+    # bisect on byte offsets: find the last entry starting at or before
+    # start_ms, parsing one entry per step
+    lo, hi = 0, os.path.getsize(path)
+    best = 0
+    while hi - lo > CHUNK_BYTES:
+        mid = (lo + hi) // 2
+        found = _first_entry_at(stream, mid)
+        if found is None or found[1][0] > start_ms:
+            hi = mid
+        else:
+            best = lo = found[0]
+            if lo >= hi:
+                break
+    return best
+
+
+def read_between(path, start_ms=None, end_ms=None):
+    """Yield the readings with start_ms <= timestamp <= end_ms.
+
+       Parameters
+       ----------
+         path (str) : the archive
+         start_ms (int) : earliest timestamp, or None for the beginning
+         end_ms (int) : latest timestamp, or None for the end
+    """
+    from compaction import expand
+    with open(path, 'rb') as stream:
+        offset = 0
+        if start_ms is not None:
+            offset = _seek_offset(stream, path, start_ms)
+        for _, entry in iter_entries(stream, offset):
+            if end_ms is not None and entry[0] > end_ms:
+                return
+            for t, db in expand([entry]):
+                if end_ms is not None and t > end_ms:
+                    return
+                if start_ms is None or t >= start_ms:
+                    yield (t, db)
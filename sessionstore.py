@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Catalog of recorded games, backed by a SQLite database.
+
+Each game gets one row in the `games` table with precomputed summary
+columns, so questions like "what was the loudest game this season" never
+have to look at individual readings. The readings themselves live in the
+`samples` table, which is indexed by time for fast range queries.
+
+Usage:
+    python sessionstore.py import totalresults_*.json
+    python sessionstore.py games
+"""
+
+from __future__ import print_function, division
+
+import glob
+import itertools
+import os
+import sqlite3
+import sys
+
+from levels import db_energy, leq
+from sessionfile import iter_readings
+
+# raised for any database problem, so callers needn't import sqlite3
+Error = sqlite3.Error
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    start_ms INTEGER,
+    end_ms INTEGER,
+    duration_ms INTEGER NOT NULL DEFAULT 0,
+    sample_count INTEGER NOT NULL DEFAULT 0,
+    max_db REAL,
+    energy REAL NOT NULL DEFAULT 0,
+    leq_db REAL
+);
+CREATE TABLE IF NOT EXISTS samples (
+    game_id INTEGER NOT NULL REFERENCES games (id),
+    t INTEGER NOT NULL,
+    db REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_game_time ON samples (game_id, t);
+CREATE INDEX IF NOT EXISTS samples_time ON samples (t);
+CREATE INDEX IF NOT EXISTS games_start ON games (start_ms);
+"""
+
+
+class SessionStore(object):
+    """SQLite-backed store of games and their decibel readings."""
+
+    def __init__(self, path='sessions.db'):
+        """Initialize the SessionStore object.
+
+           Parameters
+           ----------
+             path (str) : location of the SQLite database file; it is
+               created if it doesn't exist yet
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        # lets SQL aggregates compute Leq over arbitrary sample ranges
+        self.conn.create_function('db_energy', 1, db_energy)
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def close(self):
+        """Close the underlying database connection."""
+        self.conn.close()
+
+    def _free_name(self, name):
+        """Return `name`, or `name` with a number added if it's taken."""
+        taken = set(r[0] for r in self.conn.execute(
+            'SELECT name FROM games WHERE name = ? OR name LIKE ?',
+            (name, name + '~%')))
+        candidate, number = name, 1
+        while candidate in taken:
+            number += 1
+            candidate = '{}~{}'.format(name, number)
+        return candidate
+
+    def _insert_game(self, name, readings):
+        """Insert one game and its readings without committing."""
+        cur = self.conn.execute('INSERT INTO games (name) VALUES (?)',
+                                (self._free_name(name),))
+        game_id = cur.lastrowid
+        self._insert_readings(game_id, readings)
+        return game_id
+
+    def _insert_readings(self, game_id, readings):
+        """Insert readings for a game and refresh its summary columns."""
+        # summary of the readings, updated as the rows are inserted so
+        # that a streamed archive is never held in memory
+        seen = {'count': 0, 'energy': 0.0, 'max_db': None,
+                'start_ms': None, 'end_ms': None}
+
+        def rows():
+            for t, db in readings:
+                seen['count'] += 1
+                seen['energy'] += db_energy(db)
+                seen['max_db'] = (db if seen['max_db'] is None
+                                  else max(seen['max_db'], db))
+                seen['start_ms'] = (t if seen['start_ms'] is None
+                                    else min(seen['start_ms'], t))
+                seen['end_ms'] = (t if seen['end_ms'] is None
+                                  else max(seen['end_ms'], t))
+                yield (game_id, int(t), float(db))
+
+        self.conn.executemany(
+            'INSERT INTO samples (game_id, t, db) VALUES (?, ?, ?)', rows())
+        inserted = count = seen['count']
+        if not count:
+            return 0
+        energy, max_db = seen['energy'], seen['max_db']
+        start_ms, end_ms = seen['start_ms'], seen['end_ms']
+        row = self.conn.execute(
+            'SELECT start_ms, end_ms, sample_count, max_db, energy '
+            'FROM games WHERE id = ?', (game_id,)).fetchone()
+        if row['sample_count']:
+            start_ms = min(start_ms, row['start_ms'])
+            end_ms = max(end_ms, row['end_ms'])
+            max_db = max(max_db, row['max_db'])
+            count += row['sample_count']
+            energy += row['energy']
+        self.conn.execute(
+            'UPDATE games SET start_ms = ?, end_ms = ?, duration_ms = ?, '
+            'sample_count = ?, max_db = ?, energy = ?, leq_db = ? '
+            'WHERE id = ?',
+            (start_ms, end_ms, end_ms - start_ms, count, max_db, energy,
+             leq(energy, count), game_id))
+        return inserted
+
+    def add_game(self, name, readings):
+        """Store a complete game and return its id.
+
+           Parameters
+           ----------
+             name (str) : name for the game, e.g. the archive's file
+               name; archive names are reused from season to season, so
+               one already in the catalog gets a number added ('~2')
+             readings (iterable) : 2-tuples of a Unix timestamp in
+               milliseconds and a decibel reading
+        """
+        with self.conn:
+            return self._insert_game(name, readings)
+
+    def append_readings(self, game_id, readings):
+        """Add readings to an existing game, updating its summary.
+
+           Parameters
+           ----------
+             game_id (int) : id returned by `add_game`
+             readings (iterable) : 2-tuples of a Unix timestamp in
+               milliseconds and a decibel reading
+        """
+        with self.conn:
+            return self._insert_readings(game_id, readings)
+
+    def import_json_files(self, paths):
+        """Import JSON archives written by `save_json` in one transaction.
+
+           A file whose first reading is the start of a game already in
+           the catalog is skipped, so the same directory can be imported
+           repeatedly; so are empty files. A game from another season
+           with the same file name is imported under a numbered name.
+
+           Parameters
+           ----------
+             paths (list) : paths to `totalresults_NN.json` style files
+
+           Returns
+           -------
+             (list) : ids of the newly imported games
+        """
+        known = set(r[0] for r in self.conn.execute(
+            'SELECT start_ms FROM games WHERE start_ms IS NOT NULL'))
+        ids = []
+        with self.conn:
+            for path in paths:
+                readings = iter_readings(path)
+                first = next(readings, None)
+                if first is None or int(first[0]) in known:
+                    continue
+                name = os.path.splitext(os.path.basename(path))[0]
+                ids.append(self._insert_game(
+                    name, itertools.chain([first], readings)))
+                known.add(int(first[0]))
+        return ids
+
+    def games(self, order_by='start_ms', descending=False, limit=None):
+        """Return summary rows for all games.
+
+           Parameters
+           ----------
+             order_by (str) : one of the `games` columns, e.g. 'max_db'
+               or 'leq_db'
+             descending (boolean) : sort from largest to smallest?
+             limit (int) : maximum number of rows to return
+        """
+        columns = ('id', 'name', 'start_ms', 'end_ms', 'duration_ms',
+                   'sample_count', 'max_db', 'leq_db')
+        if order_by not in columns:
+            raise ValueError('Cannot order games by {}'.format(order_by))
+        sql = 'SELECT {} FROM games ORDER BY {} {}'.format(
+            ', '.join(columns), order_by, 'DESC' if descending else 'ASC')
+        if limit is not None:
+            sql += ' LIMIT {:d}'.format(limit)
+        return self.conn.execute(sql).fetchall()
+
+    def loudest_game(self, by='max_db'):
+        """Return the summary row of the loudest game, or None."""
+        rows = self.games(order_by=by, descending=True, limit=1)
+        return rows[0] if rows else None
+
+    def samples_between(self, start_ms, end_ms, game_id=None):
+        """Iterate over (timestamp, dB) pairs within a time range.
+
+           Parameters
+           ----------
+             start_ms (int) : inclusive lower bound, Unix time in ms
+             end_ms (int) : exclusive upper bound, Unix time in ms
+             game_id (int) : restrict results to a single game
+        """
+        if game_id is None:
+            cur = self.conn.execute(
+                'SELECT t, db FROM samples WHERE t >= ? AND t < ? '
+                'ORDER BY t', (start_ms, end_ms))
+        else:
+            cur = self.conn.execute(
+                'SELECT t, db FROM samples WHERE game_id = ? AND t >= ? '
+                'AND t < ? ORDER BY t', (game_id, start_ms, end_ms))
+        for row in cur:
+            yield row[0], row[1]
+
+    def summary_between(self, start_ms, end_ms):
+        """Return sample count, maximum and Leq within a time range."""
+        row = self.conn.execute(
+            'SELECT COUNT(*), MAX(db), SUM(db_energy(db)) FROM samples '
+            'WHERE t >= ? AND t < ?', (start_ms, end_ms)).fetchone()
+        count, max_db, energy = row[0], row[1], row[2] or 0.0
+        return {'sample_count': count, 'max_db': max_db,
+                'leq_db': leq(energy, count)}
+
+    def season_summary(self):
+        """Return totals across all games from the summary columns."""
+        row = self.conn.execute(
+            'SELECT COUNT(*), SUM(sample_count), MAX(max_db), SUM(energy), '
+            'SUM(duration_ms) FROM games').fetchone()
+        return {'games': row[0], 'sample_count': row[1] or 0,
+                'max_db': row[2], 'leq_db': leq(row[3] or 0.0, row[1]),
+                'duration_ms': row[4] or 0}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('import', 'games'):
+        print('usage: sessionstore.py import FILE [FILE ...] | games')
+        sys.exit(2)
+    with SessionStore() as store:
+        if sys.argv[1] == 'import':
+            # the Windows shell doesn't expand wildcards for us
+            paths = []
+            for pattern in sys.argv[2:]:
+                paths.extend(sorted(glob.glob(pattern)))
+            ids = store.import_json_files(paths)
+            print('Imported {} of {} files.'.format(len(ids), len(paths)))
+        else:
+            for row in store.games():
+                print('{name}: {sample_count} samples, max {max_db} dB, '
+                      'Leq {leq_db} dB'.format(**dict(zip(row.keys(), row))))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Accelerated soak test of a whole game session.
+
+Drives a complete DecibelVisualizer (readings, statistics, frame drawing
+onto a headless canvas, local file writes and uploads to an in-process
+FTP stand-in) from a simulated clock which jumps straight to the next
+deadline, so a four-hour game runs in a few minutes. Between jumps the
+clock runs in real time, so frames, uploads and the scheduler's own task
+statistics are timed as they would be in a game. Once per simulated
+minute it records the process's resident memory, the median time per
+frame and the median time per upload (medians, so a garbage collection
+or a busy moment on the machine doesn't look like a trend), then fails if
+any of them grows over the session by more than the allowed fraction.
+
+The session keeps every reading for its end-of-game archive, so memory
+is judged after taking away the archive's own size, which has to grow
+with the game; anything else that grows counts against it.
+
+Frame times are too short, and a shared machine too uneven, for their
+trend to mean much on its own. So every frame is preceded by a control
+frame of fixed size, drawn and timed the same way, and the frame time is
+judged as a ratio to the control's. A machine which slows down slows
+both, and only the app's own growth moves the ratio. The simulated meter
+also wanders freely, as a crowd does, and a loud minute draws taller bars
+(more rectangles) than a quiet one. So the ratio's trend is fitted
+together with each minute's mean number of canvas items per frame, and
+only growth which that doesn't explain counts against it.
+
+Usage:
+    python soak.py --hours 4 --csv soak.csv
+"""
+
+from __future__ import print_function, division
+
+import argparse
+import ctypes
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import types
+
+import backends
+from ftpstandin import FTPStandIn
+from publishers import FTPSink, PublisherFanout
+from scheduler import DeadlineScheduler, monotonic
+
+
+class SimulatedClock(object):
+    """Real monotonic clock which can also be moved forward at will."""
+
+    def __init__(self):
+        self.skipped = 0.0
+        self.started = monotonic()
+        self.epoch = time.time()
+
+    def advance(self, seconds):
+        """Jump the clock forward."""
+        self.skipped += seconds
+
+    def monotonic(self):
+        """Seconds since the start of the simulation."""
+        return monotonic() - self.started + self.skipped
+
+    def time(self):
+        """Simulated Unix time in seconds."""
+        return self.epoch + self.monotonic()
+
+
+class HeadlessWidget(object):
+    """Stand-in for every Tkinter widget; a Canvas keeps its items."""
+
+    def __init__(self, *args, **kwargs):
+        self.items = {}
+        self.next_id = 1
+        self.value = kwargs.get('value', '')
+
+    def __getattr__(self, name):
+        # grid, bind_all, geometry, wm_title, after and the like
+        def ignore(*args, **kwargs):
+            return None
+        return ignore
+
+    def _create(self, *args, **kwargs):
+        item = self.next_id
+        self.next_id += 1
+        tags = kwargs.get('tags', ())
+        if isinstance(tags, basestring):
+            tags = (tags,)
+        self.items[item] = (list(args), set(tags))
+        return item
+
+    create_line = create_rectangle = create_text = _create
+
+    def coords(self, item, *args):
+        if args:
+            self.items[item] = (list(args), self.items[item][1])
+        return self.items[item][0]
+
+    def delete(self, *tags):
+        for tag in tags:
+            if tag == 'all':
+                self.items.clear()
+            for item in [i for i, (_, t) in self.items.items()
+                         if i == tag or tag in t]:
+                del self.items[item]
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def headless_tkinter():
+    """Return a module which can stand in for Tkinter."""
+    module = types.ModuleType('Tkinter')
+    for name in ('Tk', 'Canvas', 'Label', 'Button', 'StringVar', 'Frame'):
+        setattr(module, name, HeadlessWidget)
+    return module
+
+
+def current_rss():
+    """Return the resident memory of this process in bytes, or None."""
+    try:
+        with open('/proc/self/statm') as stream:
+            pages = int(stream.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        pass
+    if sys.platform == 'win32':
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', ctypes.c_ulong),
+                        ('PageFaultCount', ctypes.c_ulong),
+                        ('PeakWorkingSetSize', ctypes.c_size_t),
+                        ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t),
+                        ('PeakPagefileUsage', ctypes.c_size_t)]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(
+                ctypes.windll.kernel32.GetCurrentProcess(),
+                ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+    return None
+
+
+def random_walk(low=30.0, high=130.0, seed=0):
+    """Return a function producing plausible, slowly wandering readings."""
+    rng = random.Random(seed)
+    state = [70.0]
+
+    def read_db():
+        state[0] = min(high, max(low, state[0] + rng.gauss(0, 1.5)))
+        return round(state[0], 1)
+    return read_db
+
+
+class Timed(object):
+    """Wrap a function, collecting how long each call takes."""
+
+    def __init__(self, func):
+        self.func = func
+        self.durations = []
+
+    def __call__(self, *args, **kwargs):
+        began = monotonic()
+        try:
+            return self.func(*args, **kwargs)
+        finally:
+            self.durations.append(monotonic() - began)
+
+    def drain(self):
+        """Return and forget the durations collected so far."""
+        durations, self.durations = self.durations, []
+        return durations
+
+
+class TimedSink(object):
+    """Sink wrapper collecting the duration of every send."""
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.name = sink.name
+        self.timed = Timed(sink.send)
+
+    def send(self, data):
+        return self.timed(data)
+
+
+def mean(values):
+    return sum(values) / len(values) if values else None
+
+
+def control_frame(app, height=70.0):
+    """Draw a frame of fixed size, to time the machine rather than the
+       app.
+    """
+    app.clear()
+    app.draw_identical_bars(height)
+
+
+def reading_bytes(reading):
+    """Return the memory held by one reading kept in a list."""
+    return (sys.getsizeof(reading) + struct.calcsize('P') +
+            sum(sys.getsizeof(value) for value in reading))
+
+
+def median(values):
+    if not values:
+        return None
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def growth(points, warmup=0.1):
+    """Return the fitted growth over a series, relative to its mean.
+
+       A least-squares line is fitted to the (x, y) points after the
+       first `warmup` fraction of them; its rise over the series is
+       divided by the mean of y, so 0.5 means "grew by half".
+
+       Points may carry a third value z, a known cause of variation in y
+       such as the amount being drawn. y is then fitted to x and z
+       together, and only the rise due to x is returned.
+    """
+    points = [p for p in points if p[1] is not None]
+    points = points[int(len(points) * warmup):]
+    if len(points) < 3:
+        return 0.0
+    n = len(points)
+    mx = sum(p[0] for p in points) / n
+    my = sum(p[1] for p in points) / n
+    sxx = sum((p[0] - mx) ** 2 for p in points)
+    if not sxx or not my:
+        return 0.0
+    sxy = sum((p[0] - mx) * (p[1] - my) for p in points)
+    slope = sxy / sxx
+    if len(points[0]) > 2:
+        mz = sum(p[2] for p in points) / n
+        szz = sum((p[2] - mz) ** 2 for p in points)
+        sxz = sum((p[0] - mx) * (p[2] - mz) for p in points)
+        szy = sum((p[2] - mz) * (p[1] - my) for p in points)
+        det = sxx * szz - sxz ** 2
+        if det > 1e-9 * sxx * szz:
+            slope = (szz * sxy - sxz * szy) / det
+    return slope * (points[-1][0] - points[0][0]) / my
+
+
+def run_soak(hours=4.0, sample_every=60, use_ftp=True, seed=0,
+             progress=True):
+    """Run a simulated session and return its per-minute samples.
+
+       Parameters
+       ----------
+         hours (float) : simulated length of the session
+         sample_every (int) : simulated seconds between samples
+         use_ftp (boolean) : upload to an in-process FTP stand-in?
+         seed (int) : seed for the simulated meter readings
+
+       Returns
+       -------
+         (list) : dicts with the simulated time in seconds, RSS in bytes,
+           the estimated bytes of the archived readings and RSS without
+           them, the median times of a frame, a control frame and an
+           upload in seconds, the ratio of the frame and control times,
+           the mean level in dB, the mean number of items on the canvas
+           after a frame and the number of readings held for the bars and
+           uploads
+    """
+    backends.install('gui', headless_tkinter())
+    import decibelviz
+
+    clock = SimulatedClock()
+    workdir = tempfile.mkdtemp(prefix='soak')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    standin = publisher = None
+    sinks = []
+    try:
+        if use_ftp:
+            standin = FTPStandIn().start()
+            host, port = standin.address
+            sinks.append(TimedSink(FTPSink(host, standin.user,
+                                           standin.password, 'live',
+                                           port=port, name='standin')))
+            publisher = PublisherFanout()
+            for sink in sinks:
+                publisher.add_sink(sink)
+            publisher.start()
+        app = decibelviz.DecibelVisualizer(
+            decibelviz.Tkinter.Tk(), session_db='sessions.db',
+            publisher=publisher, upload_rate=15)
+        app.meter.clock = clock.time
+        app.meter.read_db = random_walk(app.min_db, app.max_db, seed)
+        frame = Timed(app.render_frame)
+        control = Timed(lambda: control_frame(app))
+        drawn = []
+
+        def render_frame():
+            # the real frame clears the control's bars away again
+            control()
+            frame()
+            drawn.append(len(app.Canvas.items))
+        app.render_frame = render_frame
+        scheduler = DeadlineScheduler(clock=clock.monotonic)
+        app.event = 'soak'
+        app.schedule_tasks(scheduler)
+
+        samples = []
+        end = hours * 3600
+        next_sample = sample_every
+        # readings before this index were counted in an earlier sample
+        counted = 0
+        began = time.time()
+        while clock.monotonic() < end:
+            scheduler.run_due()
+            clock.advance(scheduler.time_until_next())
+            if clock.monotonic() >= next_sample:
+                uploads = []
+                for sink in sinks:
+                    uploads.extend(sink.timed.drain())
+                if standin is not None:
+                    # the stand-in's log of uploads belongs to the soak,
+                    # not the app, so it mustn't count against its memory
+                    with standin.lock:
+                        del standin.uploads[:]
+                rss = current_rss()
+                frame_seconds = median(frame.drain())
+                control_seconds = median(control.drain())
+                archive = (len(app.all_dbs) * reading_bytes(app.all_dbs[-1])
+                           if app.all_dbs else 0)
+                samples.append({
+                    'sim_seconds': next_sample,
+                    'rss': rss,
+                    'archive_bytes': archive,
+                    'rss_net': rss - archive if rss is not None else None,
+                    'frame_seconds': frame_seconds,
+                    'control_seconds': control_seconds,
+                    'frame_ratio': (frame_seconds / control_seconds
+                                    if frame_seconds and control_seconds
+                                    else None),
+                    'upload_seconds': median(uploads),
+                    'mean_db': mean([db for _, db in app.all_dbs[counted:]]),
+                    'canvas_items': mean(drawn),
+                    'recent_readings': len(app.temp_dbs),
+                })
+                del drawn[:]
+                if progress and next_sample % 3600 == 0:
+                    print('{:.0f} simulated hours in {:.0f} s'.format(
+                        next_sample / 3600, time.time() - began))
+                counted = len(app.all_dbs)
+                next_sample += sample_every
+        app.stop_reading()
+        return samples
+    finally:
+        if publisher is not None:
+            publisher.stop()
+        if standin is not None:
+            standin.stop()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hours', type=float, default=4.0,
+                        help='simulated session length')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed growth of memory and frame time, '
+                             'as a fraction of the mean')
+    parser.add_argument('--upload-tolerance', type=float, default=0.25,
+                        help='allowed growth of upload time')
+    parser.add_argument('--no-ftp', action='store_true',
+                        help="don't upload to the FTP stand-in")
+    parser.add_argument('--csv', help='write per-minute samples here')
+    args = parser.parse_args()
+
+    began = time.time()
+    samples = run_soak(args.hours, use_ftp=not args.no_ftp)
+    print('Simulated {} hours in {:.0f} s.'.format(args.hours,
+                                                   time.time() - began))
+    if args.csv:
+        columns = ('sim_seconds', 'rss', 'archive_bytes', 'rss_net',
+                   'frame_seconds', 'control_seconds', 'frame_ratio',
+                   'upload_seconds', 'mean_db', 'canvas_items',
+                   'recent_readings')
+        with open(args.csv, 'w') as stream:
+            stream.write(','.join(columns) + '\n')
+            for sample in samples:
+                stream.write(','.join(str(sample[c]) for c in columns) +
+                             '\n')
+
+    # a session which never got a reading would pass every check below
+    failed = not any(s['mean_db'] is not None for s in samples)
+    if failed:
+        print('No readings were taken.')
+    for key, tolerance, cause in (
+            # the archive has to grow; see the module docstring
+            ('rss_net', args.tolerance, None),
+            # frame cost follows what's drawn; see the module docstring
+            ('frame_ratio', args.tolerance, 'canvas_items'),
+            ('upload_seconds', args.upload_tolerance, None)):
+        change = growth([(s['sim_seconds'], s[key]) +
+                         ((s[cause] or 0.0,) if cause else ())
+                         for s in samples])
+        ok = change <= tolerance
+        failed = failed or not ok
+        print('{:<15} {:+7.1%}  {}'.format(key, change,
+                                           'ok' if ok else 'FAIL'))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
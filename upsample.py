@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Upsample raw meter readings into a smooth stream for publishing.
+
+The meter reports roughly once per second, but the app animates at a
+higher frame rate. Rather than have every client interpolate, the
+published payload carries points interpolated between each pair of raw
+readings. Everything here is a generator over the raw readings, so no
+intermediate per-pair lists are built, and the interpolation fractions
+are computed once per rate rather than once per pair.
+"""
+
+from __future__ import print_function, division
+
+import bisect
+import collections
+
+
+def interpolation_fractions(subintervals):
+    """Return the fractions 0, 1/n, ..., (n-1)/n as a tuple.
+
+       Parameters
+       ----------
+         subintervals (int) : number of points generated per pair of
+           readings, including the older reading itself
+    """
+    return tuple(s / subintervals for s in xrange(subintervals))
+
+
+def subintervals_for_rate(rate, interval_ms=1000):
+    """Return points per reading pair which give `rate` points/second.
+
+       Parameters
+       ----------
+         rate (float) : desired points per second
+         interval_ms (int) : nominal time between raw readings, in ms
+    """
+    return max(1, int(round(rate * interval_ms / 1000)))
+
+
+def upsample(readings, fractions):
+    """Yield (timestamp, dB) points interpolated between raw readings.
+
+       Parameters
+       ----------
+         readings (iterable) : chronological 2-tuples of a Unix timestamp
+           in milliseconds and a decibel reading
+         fractions (tuple) : output of `interpolation_fractions`
+    """
+    readings = iter(readings)
+    older = next(readings, None)
+    if older is None:
+        return
+    for newer in readings:
+        (t0, db0), (t1, db1) = older, newer
+        dt, ddb = t1 - t0, db1 - db0
+        for f in fractions:
+            yield int(t0 + dt * f), round(db0 + ddb * f, 2)
+        older = newer
+    yield older
+
+
+def tail(readings, since_ms):
+    """Yield the readings with timestamps at or after `since_ms`.
+
+       Parameters
+       ----------
+         readings (list) : chronological list of (timestamp, dB) tuples
+         since_ms (int) : earliest timestamp to include
+    """
+    start = bisect.bisect_left(readings, (since_ms,))
+    # keep the reading before the window so its first pair is complete
+    start = max(0, start - 1)
+    return (readings[i] for i in xrange(start, len(readings)))
+
+
+def windowed_payload(readings, rate=15, interval_ms=1000, window_ms=20000,
+                     max_bytes=65536, encode=None):
+    """Return a compact JSON array of the most recent upsampled points.
+
+       Parameters
+       ----------
+         readings (list) : chronological list of (timestamp, dB) tuples,
+           e.g. `DecibelVisualizer.all_dbs`
+         rate (float) : points per second in the output
+         interval_ms (int) : nominal time between raw readings, in ms
+         window_ms (int) : how far back from the newest reading to go
+         max_bytes (int) : upper bound on the size of the returned string;
+           the oldest points are left out to stay within it
+         encode (function) : turns the upsampled points into the entries
+           published, e.g. a `compaction.Compactor`; None publishes the
+           points themselves
+
+       Returns
+       -------
+         (str) : JSON array of [timestamp, dB] pairs, or of the entries
+           returned by `encode`
+    """
+    if not readings:
+        return '[]'
+    fractions = interpolation_fractions(subintervals_for_rate(rate,
+                                                              interval_ms))
+    since = readings[-1][0] - window_ms
+    # brackets are the only bytes outside the points themselves
+    budget = max_bytes - 2
+    parts = collections.deque()
+    size = 0
+    points = ((t, db) for t, db in upsample(tail(readings, since), fractions)
+              if t >= since)
+    if encode is not None:
+        points = encode(points)
+    for point in points:
+        part = '[' + ','.join(str(value) for value in point) + ']'
+        parts.append(part)
+        # every point but the first is preceded by a comma
+        size += len(part) + 1
+        while size - 1 > budget and parts:
+            size -= len(parts.popleft()) + 1
+    return '[' + ','.join(parts) + ']'